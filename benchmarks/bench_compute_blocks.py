@@ -0,0 +1,89 @@
+'''
+Benchmark of the block FFT stage of SPOD_base:
+	- complex FFT over all n_DFT rows (previous implementation)
+	- real-input FFT, one block at a time (`compute_blocks`)
+	- real-input FFT, several blocks per transform (`compute_blocks_batch`)
+
+Usage: python bench_compute_blocks.py [n_DFT] [nx] [n_blocks_batch]
+'''
+import os
+import sys
+import time
+import shutil
+import numpy as np
+from scipy.fft import fft
+
+# Current, parent and file paths
+CWD = os.getcwd()
+CF  = os.path.realpath(__file__)
+CFD = os.path.dirname(CF)
+
+# Import library specific modules
+sys.path.append(os.path.join(CFD,"../"))
+from pyspod.spod_low_storage import SPOD_low_storage
+
+
+
+def complex_fft_block(spod, iBlk):
+	'''Previous implementation: full complex FFT, half of it discarded.'''
+	Q_blk, offset = spod._get_block(iBlk)
+	Q_blk = Q_blk * spod._window
+	Q_blk_hat = (spod._winWeight / spod._n_DFT) * fft(Q_blk, axis=0)
+	Q_blk_hat = Q_blk_hat[0:spod._n_freq,:]
+	Q_blk_hat[1:-1,:] = 2 * Q_blk_hat[1:-1,:]
+	return Q_blk_hat, offset
+
+
+
+def main(n_DFT=256, nx=20000, n_blocks_batch=8):
+	n_blocks = 2 * n_blocks_batch
+	nt = n_DFT * n_blocks
+	X = np.random.rand(nt, nx)
+
+	params = dict()
+	params['time_step'     ] = 1
+	params['n_snapshots'   ] = nt
+	params['n_space_dims'  ] = 1
+	params['n_variables'   ] = 1
+	params['n_DFT'         ] = n_DFT
+	params['mean_type'     ] = 'blockwise'
+	params['n_modes_save'  ] = 1
+	params['n_blocks_batch'] = n_blocks_batch
+	params['savedir'       ] = os.path.join(CWD, 'results', 'bench')
+	spod = SPOD_low_storage(X, params=params, data_handler=False, variables=['x'])
+	gb = nt * nx * 8 * 9.3132257461548e-10
+
+	# all variants store the blocks in the `Q_hat` layout of SPOD_low_storage
+	Q_hat = np.empty([spod.n_freq, nx, n_blocks], dtype='complex_')
+
+	s = time.time()
+	for iBlk in range(0, n_blocks):
+		Q_hat[:,:,iBlk], _ = complex_fft_block(spod, iBlk)
+	t_fft = time.time() - s
+
+	s = time.time()
+	for iBlk in range(0, n_blocks):
+		Q_hat[:,:,iBlk], _ = spod.compute_blocks(iBlk)
+	t_rfft = time.time() - s
+
+	s = time.time()
+	for iBlk_start in range(0, n_blocks, n_blocks_batch):
+		spod.compute_blocks_batch(
+			iBlk_start, iBlk_start+n_blocks_batch, Q_hat=Q_hat)
+	t_batch = time.time() - s
+
+	print('')
+	print('Block FFT stage: n_DFT =', n_DFT, ' nx =', nx, ' n_blocks =', n_blocks)
+	print('------------------------------------')
+	print('complex fft          : {:8.3f} s ({:6.2f} GB/s)'.format(t_fft  , gb / t_fft  ))
+	print('rfft                 : {:8.3f} s ({:6.2f} GB/s)'.format(t_rfft , gb / t_rfft ))
+	print('rfft batched (x{:3d}) : {:8.3f} s ({:6.2f} GB/s)'.format(
+		n_blocks_batch, t_batch, gb / t_batch))
+	print('speed-up             : {:8.2f} x'.format(t_fft / t_batch))
+	print('------------------------------------')
+	shutil.rmtree(os.path.join(CWD, 'results', 'bench'), ignore_errors=True)
+
+
+
+if __name__ == "__main__":
+	main(*[int(a) for a in sys.argv[1:]])
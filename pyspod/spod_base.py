@@ -8,15 +8,25 @@ from __future__ import division
 import os
 import sys
 import psutil
+import json
+import hashlib
 import warnings
+import threading
 import numpy as np
 import scipy.special as sc
-from scipy.fft import fft
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from scipy.fft import fft, rfft
 from numpy import linalg as la
+from scipy import linalg as sla
 
 
 # Import custom Python packages
 import pyspod.utils_weights as utils_weights
+import pyspod.utils_parallel as utils_parallel
+import pyspod.utils_blocks as utils_blocks
+import pyspod.utils_async as utils_async
+import pyspod.utils_checkpoint as utils_checkpoint
 import pyspod.postprocessing as post
 
 # Current file path
@@ -46,8 +56,26 @@ class SPOD_base(object):
 		self._n_modes_save      = params.get('n_modes_save', 1e10)       # default is all (large number)
 		self._conf_level		= params.get('conf_level', 0.95) 	     # what confidence level to use fo eigs
 		self._reuse_blocks 		= params.get('reuse_blocks', False)      # reuse blocks if present
+		self._verify_blocks     = params.get('verify_blocks', False)     # checksum reused blocks
+		self._save_checkpoint   = params.get('checkpoint', False)        # record progress in checkpoint log
+		self._resume            = params.get('resume', False)            # resume from checkpoint log (of runs with checkpoint)
 		self._savefft           = params.get('savefft', False) 		     # save fft block if required
+		self._fft_compression   = params.get('savefft_compression', None) # compression of fft blocks
 		self._save_dir          = params.get('savedir', os.path.join(CWD, 'results')) # where to save data
+		self._n_blocks_batch    = params.get('n_blocks_batch', 1)        # blocks per batched FFT
+		self._n_workers         = params.get('n_workers', 1)             # processes for block FFTs
+		self._workers_memory    = params.get('workers_memory_gb', 'auto') # shared buffer of block FFTs
+		self._fuse_mean         = params.get('fuse_mean', False)         # longtime mean in block pass
+		self._eig_solver        = params.get('eig_solver', 'eigh')       # eigensolver ('eigh_subset': opt-in)
+		self._n_freq_batch      = params.get('n_freq_batch', 'auto')     # frequencies per batched eig
+		self._n_freq_workers    = params.get('n_freq_workers', self._n_workers) # threads for frequencies
+		self._transpose_memory  = params.get('transpose_memory_gb', 'auto') # buffer of blocks transpose
+		self._prefetch_depth    = params.get('prefetch_depth', 0)        # data reads ahead (0: off)
+		self._write_depth       = params.get('write_queue_depth', 0)     # writes behind (0: off)
+		self._tile_memory       = params.get('tile_memory_gb', 'auto')   # memory of spatial tiles (tiled)
+		self._n_snapshots_batch = params.get('n_snapshots_batch', 'auto') # snapshots per streaming read
+		self._stream_checkpoint = params.get('stream_checkpoint_blocks', 0) # streaming state saves (0: off)
+		self._mask              = params.get('mask', None)               # valid spatial points ('auto': finite in first snapshot, weighted)
 
 		# type of data management
 		# - data_handler: read type online
@@ -60,20 +88,26 @@ class SPOD_base(object):
 			if self._nv == 1 and (X.ndim != self._xdim + 2):
 				X = X[...,np.newaxis]
 		else:
+			# preloaded arrays (including memmaps) are used as they are,
+			# and snapshots are returned as views (no copies)
 			def data_handler(data, t_0, t_end, variables):
 				if t_0 > t_end:
 					raise ValueError('`t_0` cannot be greater than `t_end`.')
 				elif t_0 >= self._nt:
 					raise ValueError('`t_0` cannot be greater or equal to time dimension.')
 				elif t_0 == t_end:
-					ti = np.arange(t_0, t_0+1)
-					d = data[[t_0],...,:]
+					d = data[t_0:t_0+1]
 				else:
-					ti = np.arange(t_0, t_end)
-					d = data[ti,...,:]
+					d = data[t_0:t_end]
 				return d
+			# points [t, len(points)] of the flattened snapshots, touching
+			# only those points (e.g. of a memmap)
+			def read_points(data, t_0, t_end, variables, points):
+				d = data[t_0:t_end]
+				return np.reshape(d, (t_end-t_0, -1))[:,points]
+			data_handler.read_points = read_points
 			self._data_handler = data_handler
-			self._data = np.array(data)
+			self._data = np.asarray(data)
 			X = self._data_handler(self._data, t_0=0, t_end=0, variables=self._variables)
 			if self._nv == 1 and (self._data.ndim != self._xdim + 2):
 				X = X[...,np.newaxis]
@@ -120,6 +154,39 @@ class SPOD_base(object):
 				'1d array with dimension equal to flattened '
 				'spatial dimension of data.')
 
+		# restrict the problem to the valid spatial points of the mask
+		# (e.g. dropping land or zero-weight points): snapshots, blocks
+		# and weights hold valid points only, and modes are scattered
+		# back to the full grid when saved
+		self._mask_idx = None
+		if self._mask is not None and self._mask is not False:
+			if isinstance(self._mask, str):
+				if self._mask != 'auto':
+					raise ValueError(self._mask, 'not recognized.')
+				w = self._weights[:,0]
+				mask = np.isfinite(np.reshape(X[0], -1)) \
+					& np.isfinite(w) & (w != 0)
+			else:
+				mask = np.asarray(self._mask, dtype=bool)
+				if mask.size == self._nx:
+					mask = np.broadcast_to(
+						mask.reshape(self._xshape+(1,)), self._xshape+(self._nv,))
+				if mask.size != self._nx * self._nv:
+					raise ValueError(
+						'parameter ``mask`` must have the same size as '
+						'data spatial dimensions (times variables).')
+				mask = np.reshape(mask, -1)
+			if not np.all(mask):
+				self._mask_idx = np.flatnonzero(mask)
+				self._weights = self._weights[self._mask_idx]
+		# with a mask, snapshots read are checked for non-finite values
+		# on valid points (e.g. NaNs appearing after the first snapshot)
+		self._check_mask = self._mask is not None and self._mask is not False
+		if self._mask_idx is None:
+			self._n_points = self._nx * self._nv
+		else:
+			self._n_points = self._mask_idx.size
+
 		# Determine whether data is real-valued or complex-valued-valued
 		# to decide on one- or two-sided spectrum from data
 		self._isrealx = np.isreal(X[0]).all()
@@ -147,17 +214,89 @@ class SPOD_base(object):
 			int(np.floor((self.nt - self._n_overlap) \
 			/ (self._n_DFT - self._n_overlap)))
 
+		# set number of blocks per batched FFT
+		self._n_blocks_batch = max(1, min(int(self._n_blocks_batch), self._n_blocks))
+
+		# set number of worker processes
+		self._n_workers = max(1, int(self._n_workers))
+		if self._n_workers > 1 and not utils_parallel.fork_available():
+			warnings.warn(
+				'Parallel block computation requires the `fork` start method. '
+				'Computing blocks serially.')
+			self._n_workers = 1
+		if self._n_workers > 1 and not getattr(self._data_handler, 'fork_safe', True):
+			warnings.warn(
+				'The data handler is not fork-safe (`fork_safe` is False). '
+				'Computing blocks serially.')
+			self._n_workers = 1
+
+		# set number of threads computing frequencies
+		self._n_freq_workers = max(1, int(self._n_freq_workers))
+
 		# set number of modes to save
 		if self._n_modes_save > self._n_blocks:
 			self._n_modes_save = self._n_blocks
+		self._n_modes_save = int(self._n_modes_save)
+
+		# set eigensolver: `eig` is the general solver, `eigh` the
+		# Hermitian solver, and `eigh_subset` the Hermitian solver
+		# computing only the leading `n_modes_save` eigenpairs (and
+		# storing only those eigenvalues and their energy). The default
+		# is `eigh`, which keeps all `n_blocks` eigenvalues: `eigh_subset`
+		# is faster when `n_modes_save` << `n_blocks`, but it is never
+		# selected automatically and must be requested explicitly
+		if self._eig_solver not in ['eig', 'eigh', 'eigh_subset']:
+			raise ValueError(self._eig_solver, 'not recognized.')
+		if self._eig_solver == 'eigh_subset':
+			self._n_eigs = self._n_modes_save
+		else:
+			self._n_eigs = self._n_blocks
 
 		# test feasibility
 		if (self._n_DFT < 4) or (self._n_blocks < 2):
 			raise ValueError(
 				'Spectral estimation parameters not meaningful.')
 
-		# apply mean
-		self.select_mean()
+		# sliding buffer of snapshots shared by overlapping blocks,
+		# and counters of snapshots read and reused
+		self._buffer = None
+		self._buffer_offset = None
+		self._n_snapshots_read = 0
+		self._n_snapshots_reused = 0
+
+		# background reader of the snapshots of the next blocks
+		self._prefetch_depth = max(0, int(self._prefetch_depth))
+		self._prefetcher = None
+
+		# state of streaming SPOD (kept between calls of `partial_fit`)
+		self._stream = None
+		self._stream_checkpoint = max(0, int(self._stream_checkpoint))
+
+		# progress is recorded in the checkpoint log with `checkpoint`
+		# (or `resume`, so that a resumed fit can be resumed again):
+		# only fits recording it can be resumed
+		self._save_checkpoint = bool(self._save_checkpoint or self._resume)
+
+		# background writer of FFT blocks and modes (started by
+		# the first write, and stopped when writes are waited for);
+		# frequency threads writing concurrently share the same writer
+		self._write_depth = max(0, int(self._write_depth))
+		self._writer = None
+		self._writers = []
+		self._writer_lock = threading.Lock()
+
+		# longtime mean fused with the block pass (one pass over the data):
+		# blocks are computed without the mean, that is subtracted from
+		# their Fourier transform afterwards (the FFT is linear)
+		if self._fuse_mean and (self._mean_type.lower() != 'longtime' \
+			or self._normalize_data):
+			warnings.warn(
+				'Parameter `fuse_mean` requires `mean_type` = longtime '
+				'and `normalize_data` = False. Using a separate pass.')
+			self._fuse_mean = False
+		self._x_sum = None
+		self._raw_blocks = False
+		self._mean_fft = None
 
 		# get frequency axis
 		self.get_freq_axis()
@@ -169,7 +308,7 @@ class SPOD_base(object):
 		# get default for confidence interval
 		self._xi2_upper = 2 * sc.gammaincinv(self._n_blocks, 1 - self._conf_level)
 		self._xi2_lower = 2 * sc.gammaincinv(self._n_blocks,     self._conf_level)
-		self._eigs_c = np.zeros([self._n_freq,self._n_blocks,2], dtype='complex_')
+		self._eigs_c = np.zeros([self._n_freq,self._n_eigs,2], dtype='complex_')
 
 		# create folder to save results
 		self._save_dir_blocks = os.path.join(self._save_dir, \
@@ -178,8 +317,28 @@ class SPOD_base(object):
 		if not os.path.exists(self._save_dir_blocks):
 			os.makedirs(self._save_dir_blocks)
 
+		# store of FFT blocks (single chunked HDF5 file)
+		self._blocks_store = utils_blocks.BlockStore(
+			os.path.join(self._save_dir_blocks, 'fft_blocks.h5'),
+			n_freq=self._n_freq,
+			n_points=self._n_points,
+			n_blocks=self._n_blocks,
+			compression=self._fft_compression)
+		self._blocks_manifest = utils_blocks.BlockManifest(
+			os.path.join(self._save_dir_blocks, 'fft_blocks_manifest.json'))
+		self._blocks_key = None
+		self._modes_key = None
+		self._blocks_checksums = None
+
+		# checkpoint log of blocks and frequencies written
+		self._checkpoint = utils_checkpoint.CheckpointLog(
+			os.path.join(self._save_dir_blocks, 'checkpoint.jsonl'))
+
+		# apply mean
+		self.select_mean()
+
 		# compute approx problem size (assuming double)
-		self._pb_size = self._nt * self._nx * self._nv * 8 * BYTE_TO_GB
+		self._pb_size = self._nt * self._n_points * 8 * BYTE_TO_GB
 
 		# print parameters to the screen
 		self.print_parameters()
@@ -249,6 +408,32 @@ class SPOD_base(object):
 		'''
 		return self._nv
 
+	@property
+	def n_points(self):
+		'''
+		Get the number of points (spatial points times variables) of the
+		SPOD problem, i.e. the valid points of the mask if any.
+
+		:return: the number of points of the SPOD problem.
+		:rtype: int
+		'''
+		return self._n_points
+
+	@property
+	def mask(self):
+		'''
+		Get the mask of the valid points of the SPOD problem.
+
+		:return: the mask [x_1, ..., x_n, n_variables] (True on valid
+			points), or None if all points are valid.
+		:rtype: numpy.ndarray
+		'''
+		if self._mask_idx is None:
+			return None
+		mask = np.zeros(self._nx*self._nv, dtype=bool)
+		mask[self._mask_idx] = True
+		return mask.reshape(self._xshape+(self._nv,))
+
 	@property
 	def xdim(self):
 		'''
@@ -339,6 +524,26 @@ class SPOD_base(object):
 		'''
 		return self._n_modes_save
 
+	@property
+	def n_snapshots_read(self):
+		'''
+		Get the number of snapshots read through the data handler.
+
+		:return: the number of snapshots read so far.
+		:rtype: int
+		'''
+		return self._n_snapshots_read
+
+	@property
+	def n_snapshots_reused(self):
+		'''
+		Get the number of snapshots reused from the buffer of overlapping blocks.
+
+		:return: the number of snapshots reused so far, instead of being read.
+		:rtype: int
+		'''
+		return self._n_snapshots_reused
+
 	@property
 	def modes(self):
 		'''
@@ -359,8 +564,17 @@ class SPOD_base(object):
 	def select_mean(self):
 		"""Select mean."""
 		if self._mean_type.lower() == 'longtime':
-			self._x_mean = self.longtime_mean()
 			self._mean_name = 'longtime'
+			if self._fuse_mean:
+				# accumulated while computing the blocks
+				self._x_mean = 0
+			else:
+				# saved with the blocks of an interrupted fit if resuming
+				self._x_mean = None
+				if self._resume:
+					self._x_mean = self.load_longtime_mean()
+				if self._x_mean is None:
+					self._x_mean = self.longtime_mean()
 		elif self._mean_type.lower() == 'blockwise':
 			self._x_mean = 0
 			self._mean_name = 'blockwise'
@@ -388,17 +602,51 @@ class SPOD_base(object):
 				t_0=lb,
 				t_end=ub,
 				variables=self.variables)
+			self._check_finite(x_data, lb)
 			x_sum += np.sum(x_data, axis=0)
+			self._n_snapshots_read += ub - lb
 		if split_res > 0:
 			x_data = self._data_handler(
 				data=self._data,
 				t_0=self.nt-split_res,
 				t_end=self.nt,
 				variables=self.variables)
+			self._check_finite(x_data, self.nt-split_res)
 			x_sum += np.sum(x_data, axis=0)
+			self._n_snapshots_read += split_res
 		x_mean = x_sum / self.nt
 		x_mean = np.reshape(x_mean, (int(self.nx*self.nv)))
-		return x_mean
+		return self._compress(x_mean)
+
+
+
+	def load_longtime_mean(self):
+		"""
+		Load the longtime mean saved with the FFT blocks (see
+		`compute_all_blocks`), so that a resumed fit does not repeat
+		the pass over the data computing it.
+
+		:return: the longtime mean, or None if it is not saved with
+			blocks of the same key.
+		:rtype: numpy.ndarray
+		"""
+		key, _, _ = self.blocks_key()
+		for store in self._checkpoint_stores():
+			if not store.exists():
+				continue
+			x_mean = store.open().read_mean(key=key, subtracted=True)
+			store.close()
+			if x_mean is not None:
+				print('Resuming from checkpoint: longtime mean loaded from: ',
+					  store.path)
+				return x_mean
+		return None
+
+
+
+	def _checkpoint_stores(self):
+		"""Get the stores the blocks of an interrupted fit are saved to."""
+		return [self._blocks_store]
 
 
 
@@ -426,20 +674,422 @@ class SPOD_base(object):
 	def compute_blocks(self, iBlk):
 		"""Compute FFT blocks."""
 
+		# get (mean-subtracted, normalized) data for present block
+		Q_blk, offset = self._get_block(iBlk)
+
+		# window and Fourier transform block
+		Q_blk_hat = self._fft_blocks(Q_blk)
+
+		return Q_blk_hat, offset
+
+
+
+	def compute_blocks_batch(self, iBlk_start, iBlk_end, Q_hat=None):
+		"""
+		Compute FFT blocks `iBlk_start` to `iBlk_end` (excluded) with
+		a single batched transform. The result has the `Q_hat` layout
+		[n_freq, nx*nv, n_blocks_in_batch]; if `Q_hat` is provided the
+		blocks are written directly into `Q_hat[:,:,iBlk_start:iBlk_end]`.
+		"""
+		offsets = []
+		Q_blks = None
+		for i, iBlk in enumerate(range(iBlk_start, iBlk_end)):
+			Q_blk, offset = self._get_block(iBlk)
+			if Q_blks is None:
+				Q_blks = np.empty([self._n_DFT, iBlk_end-iBlk_start, Q_blk.shape[1]],
+					dtype=Q_blk.dtype)
+			Q_blks[:,i,:] = Q_blk
+			offsets.append(offset)
+
+		# one transform over all blocks, [n_freq, n_blocks_in_batch, nx*nv]
+		Q_blks_hat = self._fft_blocks(Q_blks)
+		Q_blks_hat = np.moveaxis(Q_blks_hat, 1, 2)
+		if Q_hat is not None:
+			Q_hat[:,:,iBlk_start:iBlk_end] = Q_blks_hat
+			return Q_hat, offsets
+		return Q_blks_hat, offsets
+
+
+
+	def compute_all_blocks(self, Q_hat=None, save_fft=False, store=None, resume=False):
+		"""
+		Compute all FFT blocks, in batches of `n_blocks_batch` blocks.
+		Blocks are stored in `Q_hat` [n_freq, nx*nv, n_blocks] if provided,
+		and saved to the blocks store if `save_fft` is True (to `store` if
+		specified, e.g. a block-major staging store). With `n_workers` > 1
+		batches are computed by a pool of processes, and returned through
+		shared memory (within `workers_memory_gb`, by default a quarter of
+		the available RAM); the result is identical to the serial computation.
+		Otherwise, with `prefetch_depth` > 0, the snapshots of the next
+		blocks are read from `data_handler` on a background thread while
+		the present block is transformed. With `checkpoint` (or `resume`),
+		saved batches are recorded in the checkpoint log; with `resume`
+		True, blocks already saved by an interrupted computation are loaded
+		instead of being recomputed.
+		"""
+		if store is None:
+			store = self._blocks_store
+		if self._fuse_mean:
+			self._x_sum = np.zeros(self._n_points)
+		blocks_done = np.zeros(self._n_blocks, dtype=bool)
+		if save_fft:
+			self.blocks_key()
+			self._blocks_manifest.remove()
+			if resume:
+				blocks_done = self._resume_blocks(store, Q_hat)
+			if not np.any(blocks_done):
+				self._checkpoint.drop('blocks')
+				self._blocks_checksums = [None] * self._n_blocks
+				store.create()
+				if self._mean_name == 'longtime' and not self._fuse_mean:
+					store.write_mean(self._x_mean, key=self.blocks_key()[0],
+						subtracted=True)
+
+		# slots of the shared buffer of the workers, within its memory
+		# budget (fewer blocks per batch, or serial blocks, if needed)
+		n_workers = self._n_workers
+		n_blocks_batch = self._n_blocks_batch
+		if n_workers > 1:
+			gb_workers = self._workers_memory
+			if gb_workers == 'auto':
+				gb_workers = utils_parallel.shared_memory_gb()
+			gb_block = self._n_freq * self._n_points * 16 * BYTE_TO_GB
+			n_slots, n_blocks_batch = utils_parallel.plan_slots(
+				gb_block, n_workers, n_blocks_batch, gb_workers)
+			if n_slots == 0:
+				warnings.warn(
+					'Shared memory of the workers (~' + str(gb_workers) + ' GB) '
+					'does not fit two FFT blocks. Computing blocks serially.')
+				n_workers = 1
+				n_blocks_batch = self._n_blocks_batch
+
+		# batches of the blocks to compute
+		batches = []
+		for iBlk_start in np.flatnonzero(~blocks_done):
+			if batches and batches[-1][1] == iBlk_start \
+				and batches[-1][1] - batches[-1][0] < n_blocks_batch:
+				batches[-1] = (batches[-1][0], iBlk_start+1)
+			else:
+				batches.append((int(iBlk_start), int(iBlk_start)+1))
+		if n_workers > 1:
+			results = utils_parallel.imap_blocks(self, batches, n_workers, n_slots)
+		else:
+			results = ((iBlk_start, iBlk_end)+self.compute_blocks_batch(iBlk_start, iBlk_end)
+				for iBlk_start, iBlk_end in batches)
+			if self._prefetch_depth > 0:
+				self._buffer = None
+				self._prefetcher = utils_async.Prefetcher(self._read_data,
+					self._snapshots_reads(np.flatnonzero(~blocks_done)),
+					self._prefetch_depth)
+		try:
+			for iBlk_start, iBlk_end, Q_blks_hat, offsets in results:
+
+				# store FFT blocks in RAM
+				if Q_hat is not None:
+					Q_hat[:,:,iBlk_start:iBlk_end] = Q_blks_hat
+
+				# save FFT blocks in storage memory if required
+				# (blocks computed in parallel are views into a reused buffer)
+				if save_fft:
+					for i in range(0, iBlk_end-iBlk_start):
+						self._blocks_checksums[iBlk_start+i] = \
+							utils_blocks.block_checksum(Q_blks_hat[:,:,i])
+					x_sum = None
+					if self._x_sum is not None:
+						x_sum = self._x_sum.copy()
+					if self._write_depth > 0 and n_workers > 1:
+						Q_blks_hat = Q_blks_hat.copy()
+					self.write(self._save_blocks, store, iBlk_start, Q_blks_hat, x_sum)
+
+				# print info file
+				for i, iBlk in enumerate(range(iBlk_start, iBlk_end)):
+					print('block '+str(iBlk+1)+'/'+str(self._n_blocks)+\
+						  ' ('+str(offsets[i])+':'+str(self._n_DFT+offsets[i])+')')
+		finally:
+			if self._prefetcher is not None:
+				self._prefetcher.close()
+				self._prefetcher = None
+		print('Snapshots read: ', self._n_snapshots_read,
+			  ' reused: ', self._n_snapshots_reused)
+		self.wait_writes()
+
+		# longtime mean from the block pass; blocks are stored without it
+		if self._fuse_mean:
+			# snapshots after the last block are not in any block
+			t_last = self._block_offset(self._n_blocks-1) + self._n_DFT
+			if t_last < self._nt:
+				X = self._read_data(t_last, self._nt)
+				X = self._compress(X.reshape(self._nt-t_last, self._nx * self._nv))
+				self._check_finite(X, t_last)
+				self._x_sum += np.sum(X, axis=0)
+				self._n_snapshots_read += self._nt - t_last
+			self._x_mean = self._x_sum / self._nt
+			self._x_sum = None
+			self._raw_blocks = True
+			if save_fft:
+				store.write_mean(self._x_mean)
+		if save_fft:
+			store.close()
+			if store is self._blocks_store:
+				self.save_blocks_manifest()
+		return Q_hat
+
+
+
+	def _save_blocks(self, store, iBlk_start, Q_blks_hat, x_sum):
+		"""Save a batch of blocks, and record it in the checkpoint log if required."""
+		iBlk_end = iBlk_start + Q_blks_hat.shape[-1]
+		store.write_blocks(iBlk_start, Q_blks_hat)
+		if x_sum is not None:
+			store.write_sum(x_sum)
+		store.flush()
+		if not self._save_checkpoint:
+			return
+		key, _, _ = self.blocks_key()
+		self._checkpoint.append({
+			'stage': 'blocks',
+			'key': key,
+			'store': os.path.basename(store.path),
+			'fuse_mean': bool(self._fuse_mean),
+			'iBlk_start': int(iBlk_start),
+			'iBlk_end': int(iBlk_end),
+			'x_sum': None if x_sum is None else utils_blocks.block_checksum(x_sum),
+			'checksums': [int(c) for c in
+				self._blocks_checksums[iBlk_start:iBlk_end]]})
+
+
+
+	def _resume_blocks(self, store, Q_hat=None):
+		"""
+		Resume the blocks saved to `store` by an interrupted computation,
+		as recorded in the checkpoint log: their checksums (and the partial
+		sum of the snapshots, if the mean is fused with the blocks) are
+		restored, and they are loaded into `Q_hat` if provided.
+
+		:return: flag of the blocks already saved.
+		:rtype: numpy.ndarray
+		"""
+		blocks_done = np.zeros(self._n_blocks, dtype=bool)
+		key, _, _ = self.blocks_key()
+		entries = [entry for entry in self._checkpoint.read('blocks', key)
+			if entry['store'] == os.path.basename(store.path) \
+			and entry['fuse_mean'] == bool(self._fuse_mean)]
+		if not entries or not store.exists():
+			return blocks_done
+		store.open('a')
+		x_sum = store.read_sum()
+		if self._fuse_mean and (x_sum is None or entries[-1]['x_sum'] \
+			!= utils_blocks.block_checksum(x_sum)):
+			store.close()
+			return blocks_done
+		self._blocks_checksums = [None] * self._n_blocks
+		for entry in entries:
+			blocks_done[entry['iBlk_start']:entry['iBlk_end']] = True
+			self._blocks_checksums[entry['iBlk_start']:entry['iBlk_end']] = \
+				entry['checksums']
+		if self._fuse_mean:
+			self._x_sum[:] = x_sum
+		if Q_hat is not None:
+			for iBlk in np.flatnonzero(blocks_done):
+				Q_hat[:,:,iBlk] = store.read_block(iBlk)
+		print('Resuming from checkpoint: ', int(np.sum(blocks_done)),
+			  ' blocks already in: ', store.path)
+		return blocks_done
+
+
+
+	def load_blocks_mean(self):
+		"""
+		Check whether blocks reused from storage were computed without
+		the longtime mean (`fuse_mean`), and if so load the mean to be
+		subtracted from them.
+		"""
+		x_mean = self._blocks_store.open().read_mean()
+		if x_mean is not None:
+			self._x_mean = x_mean
+			self._raw_blocks = True
+
+
+
+	def blocks_key(self):
+		"""
+		Get the key identifying the FFT blocks: a hash of the parameters
+		the blocks depend on, and of a fingerprint of the data (shape, type
+		and checksums of the first, middle and last snapshots). Weights are
+		not part of the key, as they are only applied to the SPOD matrix.
+
+		:return: the key, the parameters and the fingerprint.
+		:rtype: str, dict, dict
+		"""
+		if self._blocks_key is None:
+			window = np.ascontiguousarray(self._window, dtype=float)
+			params = {
+				'n_DFT': self._n_DFT,
+				'n_overlap': self._n_overlap,
+				'n_blocks': self._n_blocks,
+				'n_snapshots': self._nt,
+				'mean_type': self._mean_name,
+				'normalize_data': bool(self._normalize_data),
+				'one_sided': bool(self._isrealx),
+				'window': hashlib.sha1(window).hexdigest()}
+			snapshots = hashlib.sha1()
+			for t in sorted(set([0, self._nt // 2, self._nt - 1])):
+				X = np.ascontiguousarray(self._read_data(t, t+1))
+				snapshots.update(X)
+			mask = None
+			if self._mask_idx is not None:
+				mask = hashlib.sha1(self._mask_idx.astype('int64')).hexdigest()
+			fingerprint = {
+				'shape': [self._nt] + list(self._xshape) + [self._nv],
+				'mask': mask,
+				'dtype': str(X.dtype),
+				'variables': str(self._variables),
+				'snapshots': snapshots.hexdigest()}
+			self._blocks_key = (utils_blocks.BlockManifest.make_key(
+				params, fingerprint), params, fingerprint)
+		return self._blocks_key
+
+
+
+	def save_blocks_manifest(self):
+		"""Save the manifest of the blocks store, once all blocks are written."""
+		key, params, fingerprint = self.blocks_key()
+		self._blocks_manifest.write(
+			key, params, fingerprint, self._blocks_checksums)
+
+
+
+	def _are_blocks_present(self):
+		print('Checking if blocks are already present ...')
+		key, _, _ = self.blocks_key()
+		manifest = self._blocks_manifest.read()
+		if manifest is not None and manifest.get('key') == key \
+			and os.path.exists(self._blocks_store.path) \
+			and (not self._verify_blocks or self._are_blocks_valid(manifest)):
+			print('... all blocks are present in: ', self._blocks_store.path,
+				  ' - loading from storage.')
+			return True
+		else:
+			# evict blocks computed with other parameters or data
+			# (incomplete blocks are kept if resuming their computation)
+			if manifest is not None or (not self._resume \
+				and os.path.exists(self._blocks_store.path)):
+				print('... removing stale blocks in: ', self._blocks_store.path)
+				self._blocks_store.remove()
+				self._blocks_manifest.remove()
+			print('... blocks are not present - proceeding to compute them.\n')
+			return False
+
+
+
+	def modes_key(self):
+		"""
+		Get the key identifying the modes and eigenvalues: the key of the
+		blocks, and a hash of the weights and of the eigensolver settings.
+
+		:return: the key.
+		:rtype: str
+		"""
+		if self._modes_key is None:
+			key, _, _ = self.blocks_key()
+			weights = np.ascontiguousarray(self._weights, dtype=float)
+			content = json.dumps({
+				'blocks': key,
+				'weights': hashlib.sha1(weights).hexdigest(),
+				'n_modes_save': self._n_modes_save,
+				'n_eigs': self._n_eigs,
+				'eig_solver': self._eig_solver}, sort_keys=True)
+			self._modes_key = hashlib.sha1(content.encode()).hexdigest()
+		return self._modes_key
+
+
+
+	def frequencies_to_compute(self):
+		"""
+		Get the frequencies to compute. With `resume`, the eigenvalues and
+		modes of the frequencies recorded in the checkpoint log (and whose
+		modes are in storage) are loaded, and only the other frequencies
+		are computed; otherwise previous records are dropped.
+
+		:return: the frequencies to compute.
+		:rtype: list
+		"""
+		self._modes_key = None
+		key = self.modes_key()
+		if not self._resume:
+			self._checkpoint.drop('freq')
+			return list(range(0, self._n_freq))
+		done = set()
+		for entry in self._checkpoint.read('freq', key):
+			iFreq = entry['iFreq']
+			file_psi = os.path.join(self._save_dir_blocks, entry['file'])
+			if os.path.exists(file_psi):
+				self._modes[iFreq] = file_psi
+				self._store_eigs(np.array(entry['eigs']), iFreq)
+				done.add(iFreq)
+		if done:
+			print('Resuming from checkpoint: ', len(done),
+				  ' frequencies already computed.')
+		return [iFreq for iFreq in range(0, self._n_freq) if iFreq not in done]
+
+
+
+	def _are_blocks_valid(self, manifest):
+		"""Check the blocks in storage against the checksums of `manifest`."""
+		checksums = manifest.get('checksums', [])
+		if len(checksums) != self._n_blocks:
+			return False
+		try:
+			self._blocks_store.open()
+			for iBlk in range(0, self._n_blocks):
+				Q_blk_hat = self._blocks_store.read_block(iBlk)
+				if utils_blocks.block_checksum(Q_blk_hat) != checksums[iBlk]:
+					return False
+			return True
+		except (OSError, KeyError):
+			return False
+		finally:
+			self._blocks_store.close()
+
+
+
+	def subtract_mean_fft(self, Q_hat_f, iFreq):
+		"""
+		Subtract (in place) the Fourier transform of the windowed
+		longtime mean from the blocks `Q_hat_f` [nx*nv, n_blocks] of
+		frequency `iFreq`, computed without subtracting the mean.
+		"""
+		if self._mean_fft is None:
+			self._mean_fft = self._fft_blocks(np.ones([self._n_DFT,1]))[:,0]
+		Q_hat_f -= self._mean_fft[iFreq] * np.reshape(self._x_mean, (-1,1))
+		return Q_hat_f
+
+
+
+	def _get_block(self, iBlk):
+		"""Get data of block `iBlk`, with mean subtracted and normalized."""
+
 		# get time index for present block
-		offset = min(iBlk * (self._n_DFT - self._n_overlap) \
-			+ self._n_DFT, self._nt) - self._n_DFT
+		offset = self._block_offset(iBlk)
 
 		# Get data
-		Q_blk = self._data_handler(
-			self._data,
-			t_0=offset,
-			t_end=self._n_DFT+offset,
-			variables=self._variables)
-		Q_blk = Q_blk.reshape(self._n_DFT, self._nx * self._nv)
+		Q_blk = self._read_snapshots(offset)
+
+		# accumulate longtime mean, each snapshot being
+		# counted in the first block that contains it
+		if self._x_sum is not None:
+			t_own = 0 if iBlk == 0 else self._block_offset(iBlk-1) + self._n_DFT
+			self._x_sum += np.sum(Q_blk[max(t_own-offset,0):], axis=0)
+
+		return self._center_block(Q_blk, self._x_mean), offset
+
+
+
+	def _center_block(self, Q_blk, x_mean):
+		"""Subtract the mean `x_mean` (and block mean) from block `Q_blk`, normalized if required."""
 
 		# Subtract longtime or provided mean
-		Q_blk = Q_blk[:] - self._x_mean
+		Q_blk = Q_blk[:] - x_mean
 
 		# if block mean is to be subtracted,
 		# do it now that all data is collected
@@ -453,17 +1103,181 @@ class SPOD_base(object):
 			Q_var[Q_var < 4 * np.finfo(float).eps] = 1;
 			Q_blk = Q_blk / Q_var
 
-		# window and Fourier transform block
-		self._window = self._window.reshape(self._window.shape[0],1)
-		Q_blk = Q_blk * self._window
-		Q_blk_hat = (self._winWeight / self._n_DFT) * fft(Q_blk, axis=0);
-		Q_blk_hat = Q_blk_hat[0:self._n_freq,:];
+		return Q_blk
+
+
+
+	def _block_offset(self, iBlk):
+		"""Get time index of the first snapshot of block `iBlk`."""
+		return min(iBlk * (self._n_DFT - self._n_overlap) \
+			+ self._n_DFT, self._nt) - self._n_DFT
+
+
+
+	def _read_snapshots(self, offset):
+		"""
+		Get snapshots `offset` to `offset+n_DFT` as [n_DFT, nx*nv].
+		With overlapping blocks, snapshots are kept in a sliding buffer:
+		snapshots shared with the previous block are moved to the front
+		of the buffer, and only the new ones are read from `data_handler`.
+		The returned array is a view into the buffer.
+		"""
+		n_keep = 0
+		if self._buffer is not None:
+			n_keep = self._n_snapshots_kept(offset, self._buffer_offset)
+			if n_keep > 0:
+				self._buffer[0:n_keep] = self._buffer[self._n_DFT-n_keep:]
+		self._n_snapshots_reused += n_keep
+		if n_keep == self._n_DFT:
+			return self._buffer
+
+		# read new snapshots (from the prefetcher if reading ahead)
+		if self._prefetcher is not None:
+			X = self._prefetcher.get((offset+n_keep, self._n_DFT+offset))
+		else:
+			X = self._read_data(offset+n_keep, self._n_DFT+offset)
+		X = self._compress(X.reshape(self._n_DFT-n_keep, self._nx * self._nv))
+		self._check_finite(X, offset+n_keep)
+		self._n_snapshots_read += self._n_DFT - n_keep
+		if self._n_overlap == 0:
+			return X
+		if self._buffer is None:
+			self._buffer = np.empty([self._n_DFT, self._n_points], dtype=X.dtype)
+		self._buffer[n_keep:] = X
+		self._buffer_offset = offset
+		return self._buffer
+
+
+
+	def _compress(self, X):
+		"""Restrict flattened snapshots [..., nx*nv] to the valid points of the mask."""
+		if self._mask_idx is None:
+			return X
+		return X[...,self._mask_idx]
+
+
+
+	def _check_finite(self, X, t_0, points=None):
+		"""
+		Check that snapshots `X` read from time `t_0` are finite on the
+		valid points of the mask (if a mask is given). `X` holds either
+		full snapshots, or the valid points only [n, n_points], or the
+		points `points` (indices or slice) of the full grid.
+		"""
+		if not self._check_mask:
+			return
+		X = np.reshape(X, (X.shape[0], -1))
+		if points is None and X.shape[1] == self._nx * self._nv:
+			X = self._compress(X)
+		finite = np.isfinite(X)
+		if finite.all():
+			return
+		t, i = np.nonzero(~finite)
+		if points is None:
+			points = self._mask_idx
+		if isinstance(points, slice):
+			i = np.arange(*points.indices(self._nx*self._nv))[i]
+		elif points is not None:
+			i = np.asarray(points)[i]
+		i = np.unique(i)
+		raise ValueError(
+			'Non-finite values from snapshot {} at valid points of the '
+			'mask (flattened indices [nx*nv]): {}{}. Exclude these points '
+			'with parameter ``mask``.'.format(t_0 + t[0],
+			i[:10].tolist(), ' ...' if i.size > 10 else ''))
+
+
+
+	def _expand(self, Psi):
+		"""Scatter [n_points, ...] back to the full grid [nx*nv, ...] (zero on masked points)."""
+		if self._mask_idx is None:
+			return Psi
+		Psi_full = np.zeros((self._nx*self._nv,)+Psi.shape[1:], dtype=Psi.dtype)
+		Psi_full[self._mask_idx] = Psi
+		return Psi_full
+
+
+
+	def _n_snapshots_kept(self, offset, buffer_offset):
+		"""Number of snapshots of the block at `offset` already in the buffer."""
+		shift = offset - buffer_offset
+		if self._n_overlap > 0 and 0 <= shift < self._n_DFT:
+			return self._n_DFT - shift
+		return 0
+
+
+
+	def _snapshots_reads(self, blocks):
+		"""
+		Get the ranges (t_0, t_end) of snapshots read by `_read_snapshots`
+		when computing `blocks` in order, starting from an empty buffer.
+		"""
+		reads = []
+		buffer_offset = None
+		for iBlk in blocks:
+			offset = self._block_offset(iBlk)
+			n_keep = 0
+			if buffer_offset is not None:
+				n_keep = self._n_snapshots_kept(offset, buffer_offset)
+			if n_keep < self._n_DFT:
+				reads.append((offset+n_keep, self._n_DFT+offset))
+				buffer_offset = offset
+		return reads
+
+
+
+	def _read_points(self, t_0, t_end, points):
+		"""
+		Read snapshots `t_0` to `t_end` at the points `points` (slice or
+		indices) of the flattened snapshots [nx*nv], as [t_end-t_0, n].
+		Only the points are read if `data_handler` provides a method
+		`read_points(data, t_0, t_end, variables, points)`, otherwise
+		the whole snapshots are read and the points selected.
+		"""
+		read_points = getattr(self._data_handler, 'read_points', None)
+		if read_points is not None:
+			return read_points(self._data, t_0, t_end, self._variables, points)
+		X = self._read_data(t_0, t_end)
+		return np.reshape(X, (t_end-t_0, self._nx*self._nv))[:,points]
+
+
+
+	def _read_data(self, t_0, t_end):
+		"""Read snapshots `t_0` to `t_end` from `data_handler`."""
+		return self._data_handler(
+			self._data,
+			t_0=t_0,
+			t_end=t_end,
+			variables=self._variables)
 
-		# correct Fourier coefficients for one-sided spectrum
-		if self._isrealx:
-			Q_blk_hat[1:-1,:] = 2 * Q_blk_hat[1:-1,:]
 
-		return Q_blk_hat, offset
+
+	def _fft_blocks(self, Q_blk):
+		"""
+		Window and Fourier transform along time (first axis) one block
+		[n_DFT, nx*nv] or a stack of blocks [n_DFT, ...]. The input is
+		overwritten. Real-valued data use a real-input FFT, that computes
+		only the one-sided spectrum. Integer data are cast to float.
+		"""
+		Q_blk = np.asarray(Q_blk, dtype=np.result_type(Q_blk, float))
+		Q_blk *= self._window.reshape((self._n_DFT,)+(1,)*(Q_blk.ndim-1))
+		if self._isrealx:
+			if np.iscomplexobj(Q_blk):
+				Q_blk = Q_blk.real
+			Q_blk_hat = rfft(Q_blk, axis=0, overwrite_x=True)
+			# for odd n_DFT the frequency axis holds one more entry
+			# than rfft, i.e. the conjugate of the last one
+			if Q_blk_hat.shape[0] < self._n_freq:
+				Q_blk_hat = np.concatenate(
+					(Q_blk_hat, Q_blk_hat[-1:].conj()), axis=0)
+			Q_blk_hat *= (self._winWeight / self._n_DFT)
+
+			# correct Fourier coefficients for one-sided spectrum
+			Q_blk_hat[1:-1] *= 2
+		else:
+			Q_blk_hat = (self._winWeight / self._n_DFT) * fft(Q_blk, axis=0)
+			Q_blk_hat = Q_blk_hat[0:self._n_freq]
+		return Q_blk_hat
 
 
 
@@ -473,27 +1287,75 @@ class SPOD_base(object):
 		# compute inner product in frequency space, for given frequency
 		M = np.matmul(Q_hat_f.conj().T, (Q_hat_f * self._weights))  / self._n_blocks
 
-		# extract eigenvalues and eigenvectors
-		L,V = la.eig(M)
-		L = np.real_if_close(L, tol=1000000)
-
-		# reorder eigenvalues and eigenvectors
-		idx = np.argsort(L)[::-1]
-		L = L[idx]
-		V = V[:,idx]
+		# extract eigenvalues and eigenvectors (in descending order)
+		L,V = self.eig_solve(M)
 
 		# compute spatial modes for given frequency
+		L_save = L[0:self._n_modes_save]
+		V_save = V[:,0:self._n_modes_save]
 		Psi = np.matmul(Q_hat_f, np.matmul(\
-			V, np.diag(1. / np.sqrt(L) / np.sqrt(self._n_blocks))))
+			V_save, np.diag(1. / np.sqrt(abs(L_save)) / np.sqrt(self._n_blocks))))
+
+		# store modes and eigenvalues
+		self._store_modes(Psi, L, iFreq)
+
+
+
+	def compute_standard_spod_batch(self, Q_hat_fs, iFreq_start):
+		"""
+		Compute standard SPOD for a stack of frequencies at once, from
+		`Q_hat_fs` [n_freq_in_batch, nx*nv, n_blocks] starting at frequency
+		`iFreq_start`. Inner products, Hermitian eigendecompositions and
+		modes are computed with one batched operation each.
+		"""
+
+		# compute inner products in frequency space, for all given frequencies
+		M = np.matmul(Q_hat_fs.conj().transpose(0,2,1), Q_hat_fs * self._weights) \
+			/ self._n_blocks
+
+		# extract eigenvalues and eigenvectors (in descending order)
+		L,V = la.eigh(M)
+		L = L[:,::-1]
+		V = V[:,:,::-1]
+
+		# compute spatial modes for all given frequencies
+		L_save = L[:,0:self._n_modes_save]
+		V_save = V[:,:,0:self._n_modes_save]
+		Psi = np.matmul(Q_hat_fs, V_save \
+			/ (np.sqrt(abs(L_save)) * np.sqrt(self._n_blocks))[:,np.newaxis,:])
+
+		# store modes and eigenvalues
+		for i in range(0, Q_hat_fs.shape[0]):
+			self._store_modes(Psi[i], L[i,0:self._n_eigs], iFreq_start+i)
+
+
+
+	def _store_modes(self, Psi, L, iFreq):
+		"""Save modes and store eigenvalues of frequency `iFreq`."""
 
 		# save modes in storage too in case post-processing crashes
-		Psi = Psi[:,0:self._n_modes_save]
-		Psi = Psi.reshape(self._xshape+(self._nv,)+(self._n_modes_save,))
+		Psi = self._expand(Psi).reshape(self._xshape+(self._nv,)+(self._n_modes_save,))
 		file_psi = os.path.join(self._save_dir_blocks,
 			'modes1to{:04d}_freq{:04d}.npy'.format(self._n_modes_save, iFreq))
-		np.save(file_psi, Psi)
+		self.write(np.save, file_psi, Psi)
 		self._modes[iFreq] = file_psi
-		self._eigs[iFreq,:] = abs(L)
+		self._store_eigs(abs(L), iFreq)
+
+		# record frequency in checkpoint log, once its modes are written
+		if not self._save_checkpoint:
+			return
+		self.write(self._checkpoint.append, {
+			'stage': 'freq',
+			'key': self.modes_key(),
+			'iFreq': int(iFreq),
+			'file': os.path.basename(file_psi),
+			'eigs': [float(l) for l in abs(L)]})
+
+
+
+	def _store_eigs(self, L, iFreq):
+		"""Store eigenvalues of frequency `iFreq` and their confidence interval."""
+		self._eigs[iFreq,:] = L
 
 		# get and save confidence interval
 		self._eigs_c[iFreq,:,0] = \
@@ -503,8 +1365,86 @@ class SPOD_base(object):
 
 
 
+	def map_frequencies(self, func, iFreqs, desc='computing frequencies'):
+		"""
+		Call `func(iFreq)` for all frequencies in `iFreqs`. Frequencies are
+		independent, and with `n_freq_workers` > 1 they are computed by a
+		pool of threads, sharing blocks in RAM and writing modes concurrently;
+		BLAS threads are capped so that the workers do not oversubscribe
+		the cores.
+		"""
+		if self._n_freq_workers == 1:
+			for iFreq in tqdm(iFreqs, desc=desc):
+				func(iFreq)
+			return
+		with utils_parallel.blas_threads_limit(self._n_freq_workers), \
+			ThreadPoolExecutor(max_workers=self._n_freq_workers) as pool:
+			futures = [pool.submit(func, iFreq) for iFreq in iFreqs]
+			for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+				future.result()
+
+
+
+	def eig_solve(self, M):
+		"""
+		Compute eigenvalues and eigenvectors of the cross-spectral
+		density matrix `M`, sorted by descending eigenvalue. With the
+		`eigh_subset` solver only the leading `n_modes_save` are computed.
+		"""
+		if self._eig_solver == 'eig':
+			L,V = la.eig(M)
+			L = np.real_if_close(L, tol=1000000)
+			idx = np.argsort(L)[::-1]
+			return L[idx], V[:,idx]
+		elif self._eig_solver == 'eigh':
+			L,V = sla.eigh(M)
+		else:
+			n = M.shape[0]
+			L,V = sla.eigh(M, subset_by_index=[n-self._n_modes_save, n-1])
+		return L[::-1], V[:,::-1]
+
+
+
+	def write(self, func, *args):
+		"""
+		Write results calling `func(*args)`, on the background writer
+		if `write_queue_depth` > 0, otherwise immediately. The writer
+		thread is started by the first write.
+		"""
+		if self._write_depth > 0:
+			with self._writer_lock:
+				if self._writer is None:
+					self._writer = utils_async.AsyncWriter(self._write_depth)
+					self._writers.append(self._writer)
+				writer = self._writer
+			writer.submit(func, *args)
+		else:
+			func(*args)
+
+
+
+	def wait_writes(self):
+		"""
+		Wait for all pending writes, raising their first error if any,
+		and stop the writer threads.
+		"""
+		with self._writer_lock:
+			writers, self._writers = self._writers, []
+			self._writer = None
+		error = None
+		for writer in writers:
+			try:
+				writer.close()
+			except BaseException as e:
+				if error is None:
+					error = e
+		if error is not None:
+			raise error
+
+
+
 	def store_and_save(self):
-		"""Store and save results."""
+		"""Store and save results, once all pending writes are done."""
 
 		self._eigs_c_u = self._eigs_c[:,:,0]
 		self._eigs_c_l = self._eigs_c[:,:,1]
@@ -515,6 +1455,7 @@ class SPOD_base(object):
 			eigs_c_l=self._eigs_c_l,
 			f=self._freq)
 		self._n_modes = self._eigs.shape[-1]
+		self.wait_writes()
 
 
 
@@ -536,13 +1477,30 @@ class SPOD_base(object):
 		print('Time snapshots             : ', self._nt)
 		print('Space dimensions           : ', self._xdim)
 		print('Number of variables        : ', self._nv)
+		print('Valid points (mask)        : ', self._n_points, '/', self._nx*self._nv)
 		print('Normalization weights      : ', self._normalize_weights)
 		print('Normalization data         : ', self._normalize_data)
 		print('Number of modes to be saved: ', self._n_modes_save)
+		print('Eigensolver                : ', self._eig_solver)
+		print('Frequencies per batched eig: ', self._n_freq_batch)
 		print('Confidence level for eigs  : ', self._conf_level)
 		print('Results to be saved in     : ', self._save_dir)
 		print('Save FFT blocks            : ', self._savefft)
 		print('Reuse FFT blocks           : ', self._reuse_blocks)
+		print('Verify reused FFT blocks   : ', self._verify_blocks)
+		print('Checkpoint log recorded    : ', self._save_checkpoint)
+		print('Resume from checkpoint     : ', self._resume)
+		print('Blocks per batched FFT     : ', self._n_blocks_batch)
+		print('Processes for FFT blocks   : ', self._n_workers)
+		print('Workers shared memory GB   : ', self._workers_memory)
+		print('Threads for frequencies    : ', self._n_freq_workers)
+		print('Blocks transpose buffer GB : ', self._transpose_memory)
+		print('Spatial tiles memory GB    : ', self._tile_memory)
+		print('Snapshots per stream read  : ', self._n_snapshots_batch)
+		print('Streaming state saved every: ', self._stream_checkpoint, 'blocks')
+		print('Mean fused with blocks     : ', self._fuse_mean)
+		print('Data reads ahead (prefetch): ', self._prefetch_depth)
+		print('Writes behind (queue depth): ', self._write_depth)
 		if self._isrealx: print('Spectrum type             : ',
 			'one-sided (real-valued signal)')
 		else            : print('Spectrum type             : ',
@@ -609,7 +1567,7 @@ class SPOD_base(object):
 			if self._nv == 1 and (X.ndim != self._xdim + 2):
 				X = X[...,np.newaxis]
 		else:
-			X = self._data[t_0, t_end]
+			X = self._data[t_0:t_end]
 		return X
 
 	# ---------------------------------------------------------------------------
@@ -619,28 +1577,6 @@ class SPOD_base(object):
 	# static methods
 	# ---------------------------------------------------------------------------
 
-	@staticmethod
-	def _are_blocks_present(n_blocks, n_freq, saveDir):
-		print('Checking if blocks are already present ...')
-		all_blocks_exist = 0
-		for iBlk in range(0,n_blocks):
-			all_freq_exist = 0
-			for iFreq in range(0,n_freq):
-				file = os.path.join(saveDir,
-					'fft_block{:04d}_freq{:04d}.npy'.format(iBlk,iFreq))
-				if os.path.exists(file):
-					all_freq_exist = all_freq_exist + 1
-			if (all_freq_exist == n_freq):
-				print('block '+str(iBlk+1)+'/'+str(n_blocks)+\
-					' is present in: ', saveDir)
-				all_blocks_exist = all_blocks_exist + 1
-		if all_blocks_exist == n_blocks:
-			print('... all blocks are present - loading from storage.')
-			return True
-		else:
-			print('... blocks are not present - proceeding to compute them.\n')
-			return False
-
 	# @staticmethod
 	# def _nextpow2(a):
 	# 	'''
@@ -5,12 +5,13 @@ import os
 import sys
 import time
 import numpy as np
-from tqdm import tqdm
 import shutil
+import psutil
 
 
 # Import PySPOD base class for SPOD_low_ram
 from pyspod.spod_base import SPOD_base
+import pyspod.utils_blocks as utils_blocks
 
 CWD = os.getcwd()
 BYTE_TO_GB = 9.3132257461548e-10
@@ -39,32 +40,38 @@ class SPOD_low_ram(SPOD_base):
 		print('Calculating temporal DFT (low_ram)')
 		print('------------------------------------')
 
+		# frequencies to compute (all, unless resuming from checkpoint)
+		self._eigs = np.zeros([self._n_freq, self._n_eigs], dtype='complex_')
+		self._modes = dict()
+		iFreqs = self.frequencies_to_compute()
+
 		# check if blocks are already saved in memory
 		blocks_present = False
-		if self._reuse_blocks:
-			blocks_present = self._are_blocks_present(\
-				self._n_blocks, self._n_freq, self._save_dir_blocks)
+		if (self._reuse_blocks or self._resume) and iFreqs:
+			blocks_present = self._are_blocks_present()
 
 		# loop over number of blocks and generate Fourier realizations,
-		# if blocks are not saved in storage
-		if not blocks_present:
-			Q_blk = np.zeros([self._n_DFT,self._nx], dtype='complex_')
-			for iBlk in range(0,self._n_blocks):
-
-				# compute block
-				Q_blk_hat, offset = self.compute_blocks(iBlk)
-
-				# print info file
-				print('block '+str(iBlk+1)+'/'+str(self._n_blocks)+\
-					  ' ('+str(offset)+':'+str(self._n_DFT+offset)+'); ',
-					  '    Saving to directory: ', self._save_dir_blocks)
-
-				# save FFT blocks in storage memory
-				for iFreq in range(0, self._n_freq):
-					file = os.path.join(self._save_dir_blocks,
-						'fft_block{:04d}_freq{:04d}.npy'.format(iBlk, iFreq))
-					Q_blk_hat_fi = Q_blk_hat[iFreq,:]
-					np.save(file, Q_blk_hat_fi)
+		# if blocks are not saved in storage; blocks are written contiguously
+		# to a block-major staging store, and then transposed out-of-core
+		# into the frequency-major store, so that each frequency below is
+		# loaded with one sequential read
+		if not iFreqs:
+			print('All frequencies already computed.')
+		elif not blocks_present:
+			staging = self._staging_store()
+			print('Saving FFT blocks to: ', staging.path)
+			self.compute_all_blocks(save_fft=True, store=staging, resume=self._resume)
+			gb_transpose = self._transpose_memory
+			if gb_transpose == 'auto':
+				gb_transpose = 0.25 * psutil.virtual_memory()[1] * BYTE_TO_GB
+			print('Transposing FFT blocks to: ', self._blocks_store.path,
+				  ' (buffer ~', gb_transpose, 'GB)')
+			staging.open().transpose(self._blocks_store, gb_transpose)
+			self._blocks_store.close()
+			staging.remove()
+			self.save_blocks_manifest()
+		else:
+			self.load_blocks_mean()
 
 		print('------------------------------------')
 
@@ -74,8 +81,6 @@ class SPOD_low_ram(SPOD_base):
 		print(' ')
 		print('Calculating SPOD (low_ram)')
 		print('------------------------------------')
-		self._eigs = np.zeros([self._n_freq, self._n_blocks], dtype='complex_')
-		self._modes = dict()
 
 		gb_memory_modes = self._n_freq * self._nx * \
 			self._n_modes_save * sys.getsizeof(complex()) * BYTE_TO_GB
@@ -98,30 +103,49 @@ class SPOD_low_ram(SPOD_base):
 			self._n_modes_save = n_modes_save
 
 		# load FFT blocks from hard drive and save modes on hard drive (for large data)
-		for iFreq in tqdm(range(0,self._n_freq),desc='computing frequencies'):
+		if iFreqs:
+			self._blocks_store.open()
+		def compute_freq(iFreq):
 
-			# load FFT data from previously saved file
-			Q_hat_f = np.zeros([self._nx,self._n_blocks], dtype='complex_')
-			for iBlk in range(0,self._n_blocks):
-				file = os.path.join(self._save_dir_blocks,
-					'fft_block{:04d}_freq{:04d}.npy'.format(iBlk,iFreq))
-				Q_hat_f[:,iBlk] = np.load(file)
+			# load FFT data from blocks store
+			Q_hat_f = self._blocks_store.read_freq(iFreq)
+
+			# subtract longtime mean if blocks were computed without it
+			if self._raw_blocks:
+				self.subtract_mean_fft(Q_hat_f, iFreq)
 
 			# compute standard spod
 			self.compute_standard_spod(Q_hat_f, iFreq)
 
+		self.map_frequencies(compute_freq, iFreqs)
+
 		# store and save results
 		self.store_and_save()
 
 		# delete FFT blocks from memory if saving not required
+		self._blocks_store.close()
 		if self._savefft == False:
-			for iBlk in range(0,self._n_blocks):
-				for iFreq in range(0,self._n_freq):
-					file = os.path.join(self._save_dir_blocks,
-						'fft_block{:04d}_freq{:04d}.npy'.format(iBlk,iFreq))
-					os.remove(file)
+			self._blocks_store.remove()
+			self._blocks_manifest.remove()
 		print('------------------------------------')
 		print(' ')
 		print('Results saved in folder ', self._save_dir_blocks)
 		print('Elapsed time: ', time.time() - start, 's.')
 		return self
+
+
+
+	def _staging_store(self):
+		"""Get the block-major store the FFT blocks are first written to."""
+		return utils_blocks.BlockStore(
+			os.path.join(self._save_dir_blocks, 'fft_blocks_staging.h5'),
+			n_freq=self._n_freq,
+			n_points=self._n_points,
+			n_blocks=self._n_blocks,
+			layout='block')
+
+
+
+	def _checkpoint_stores(self):
+		"""Get the stores the blocks of an interrupted fit are saved to."""
+		return [self._blocks_store, self._staging_store()]
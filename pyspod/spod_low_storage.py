@@ -5,7 +5,6 @@ import os
 import sys
 import time
 import numpy as np
-from tqdm import tqdm
 import psutil
 
 
@@ -40,7 +39,7 @@ class SPOD_low_storage(SPOD_base):
 		print('--------------------------------------')
 
 		# check RAM requirements
-		gb_vram_required = self._n_DFT * self._nx * self._nv \
+		gb_vram_required = self._n_DFT * self._n_points \
 			* sys.getsizeof(complex()) * BYTE_TO_GB
 
 		gb_vram_avail = psutil.virtual_memory()[1] * BYTE_TO_GB
@@ -51,45 +50,36 @@ class SPOD_low_storage(SPOD_base):
 				'RAM required larger than RAM available... '
 				'consider running spod_low_ram to avoid system freezing.')
 
+		# frequencies to compute (all, unless resuming from checkpoint)
+		self._eigs = np.zeros([self._n_freq,self._n_eigs], dtype='complex_')
+		self._modes = dict()
+		iFreqs = self.frequencies_to_compute()
+
 		# check if blocks are already saved in memory
 		blocks_present = False
-		if self._reuse_blocks:
-			blocks_present = self._are_blocks_present(
-				self._n_blocks,self._n_freq,self._save_dir_blocks)
+		if (self._reuse_blocks or self._resume) and iFreqs:
+			blocks_present = self._are_blocks_present()
 
-		Q_blk = np.empty([self._n_DFT,int(self._nx*self._nv)])
-		Q_hat = np.empty([self._n_freq,self._nx*self.nv,self._n_blocks], dtype='complex_')
-		Q_blk_hat = np.empty([self._n_DFT,int(self._nx*self._nv)], dtype='complex_')
+		Q_hat = np.empty([self._n_freq,self._n_points,self._n_blocks], dtype='complex_')
 
-		if blocks_present:
+		if not iFreqs:
+			print('All frequencies already computed.')
+		elif blocks_present:
 			# load blocks if present
-			for iFreq in range(0,self._n_freq):
-				for iBlk in range(0,self._n_blocks):
-					file = os.path.join(self._save_dir_blocks,\
-						'fft_block{:04d}_freq{:04d}.npy'.format(iBlk,iFreq))
-					Q_hat[iFreq,:,iBlk] = np.load(file)
+			self._blocks_store.open().read_freqs(0, self._n_freq, out=Q_hat)
+			self.load_blocks_mean()
+			self._blocks_store.close()
 		else:
 			# loop over number of blocks and generate Fourier realizations
-			# if blocks are not saved in storage
-			for iBlk in range(0,self._n_blocks):
-
-				# compute block
-				Q_blk_hat, offset = self.compute_blocks(iBlk)
-
-				# print info file
-				print('block '+str(iBlk+1)+'/'+str(self._n_blocks)+\
-					  ' ('+str(offset)+':'+str(self._n_DFT+offset)+')')
-
-				# save FFT blocks in storage memory if required
-				if self._savefft:
-					for iFreq in range(0,self._n_freq):
-						file = os.path.join(self._save_dir_blocks,
-							'fft_block{:04d}_freq{:04d}.npy'.format(iBlk,iFreq))
-						Q_blk_hat_fi = Q_blk_hat[iFreq,:]
-						np.save(file, Q_blk_hat_fi)
-
-				# store FFT blocks in RAM
-				Q_hat[:,:,iBlk] = Q_blk_hat
+			# if blocks are not saved in storage, and store them in RAM;
+			# blocks are saved with checkpoints, to checkpoint the block stage
+			self.compute_all_blocks(Q_hat=Q_hat,
+				save_fft=self._savefft or self._save_checkpoint, resume=self._resume)
+
+		# subtract longtime mean if blocks were computed without it
+		if self._raw_blocks:
+			for iFreq in iFreqs:
+				self.subtract_mean_fft(Q_hat[iFreq,:,:], iFreq)
 		print('--------------------------------------')
 
 
@@ -98,20 +88,59 @@ class SPOD_low_storage(SPOD_base):
 		print(' ')
 		print('Calculating SPOD (low_storage)')
 		print('--------------------------------------')
-		self._eigs = np.zeros([self._n_freq,self._n_blocks], dtype='complex_')
-		self._modes = dict()
+
+		# number of frequencies decomposed together; batching pays off
+		# for small matrices (few blocks), and requires a Hermitian solver
+		n_freq_batch = self._n_freq_batch
+		if self._eig_solver == 'eig':
+			n_freq_batch = 1
+		elif n_freq_batch == 'auto':
+			if self._n_blocks > 32:
+				n_freq_batch = 1
+			else:
+				gb_vram_freq = self._n_points * (self._n_blocks + self._n_modes_save) \
+					* sys.getsizeof(complex()) * BYTE_TO_GB
+				n_freq_batch = int(0.05 * gb_vram_avail / gb_vram_freq)
+		n_freq_batch = max(1, min(int(n_freq_batch), self._n_freq))
 
 		# keep everything in RAM memory (default)
-		for iFreq in tqdm(range(0,self._n_freq),desc='computing frequencies'):
+		if n_freq_batch > 1:
+			def compute_freq_batch(batch):
+
+				# get FFT blocks from RAM memory for a batch of frequencies
+				Q_hat_fs = Q_hat[batch[0]:batch[1],:,:]
+
+				# compute standard spod
+				self.compute_standard_spod_batch(Q_hat_fs, batch[0])
+
+			# batches of consecutive frequencies
+			batches = []
+			for iFreq in iFreqs:
+				if batches and batches[-1][1] == iFreq \
+					and batches[-1][1] - batches[-1][0] < n_freq_batch:
+					batches[-1] = (batches[-1][0], iFreq+1)
+				else:
+					batches.append((iFreq, iFreq+1))
+			self.map_frequencies(compute_freq_batch,
+				batches, desc='computing frequencies (batched)')
+		else:
+			def compute_freq(iFreq):
+
+				# get FFT block from RAM memory for each given frequency
+				Q_hat_f = np.squeeze(Q_hat[iFreq,:,:]).astype('complex_')
 
-			# get FFT block from RAM memory for each given frequency
-			Q_hat_f = np.squeeze(Q_hat[iFreq,:,:]).astype('complex_')
+				# compute standard spod
+				self.compute_standard_spod(Q_hat_f, iFreq)
 
-			# compute standard spod
-			self.compute_standard_spod(Q_hat_f, iFreq)
+			self.map_frequencies(compute_freq, iFreqs)
 
 		# store and save results
 		self.store_and_save()
+
+		# delete FFT blocks saved only to checkpoint the block stage
+		if self._save_checkpoint and not self._savefft:
+			self._blocks_store.remove()
+			self._blocks_manifest.remove()
 		print('--------------------------------------')
 		print(' ')
 
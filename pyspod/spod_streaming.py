@@ -2,12 +2,15 @@
 
 # import standard python packages
 import os
+import json
 import time
+import hashlib
 import numpy as np
 from numpy import linalg as la
 
 # import PySPOD base class for SSPOD
 from pyspod.spod_base import SPOD_base
+import pyspod.utils_async as utils_async
 
 
 
@@ -20,8 +23,25 @@ class SPOD_streaming(SPOD_base):
 	The computation is performed on the data *X* passed to the
 	constructor of the `SPOD_streaming` class, derived from
 	the `SPOD_base` class.
+
+	Snapshots can also be pushed as they are produced (e.g. in situ,
+	by a running solver) with `partial_fit`, and the results saved with
+	`finalize`; the data passed to the constructor then only sets the
+	shape of the snapshots. The state kept between calls (incomplete
+	Fourier sums, sample mean and basis) does not grow with the stream.
+
+	The state can be saved with `save_state` (and every
+	`stream_checkpoint_blocks` blocks), and loaded with `load_state`:
+	with `resume` True, `fit` continues from the saved state, giving the
+	same results as an uninterrupted run.
 	"""
 
+	# version of the format of the saved state
+	STATE_VERSION = 2
+
+	# arrays and counters of the saved state
+	STATE_ITEMS = ['t_idx', 'X_sum', 'mu', 'n_mu', 'U_hat', 'S_hat', 'block_i', 'ti']
+
 	def fit(self):
 		"""
 		Class-specific method to fit the data matrix X using the SPOD
@@ -29,8 +49,206 @@ class SPOD_streaming(SPOD_base):
 		"""
 		start = time.time()
 
-		# sqrt of weights
-		sqrtW = np.sqrt(self._weights)
+		print(' ')
+		print('Calculating temporal DFT (streaming)')
+		print('------------------------------------')
+		self._init_stream()
+
+		# continue from the saved state if resuming
+		t_start = 0
+		if self._resume and os.path.exists(self.state_path):
+			try:
+				self.load_state()
+				t_start = self._stream['ti'] + 1
+				print('Resuming from saved state: ', t_start, 'snapshots ingested.')
+			except ValueError as e:
+				print('... ignoring saved state: ', e)
+				self._init_stream()
+
+		# snapshots read and added to the Fourier sums together (reads
+		# of a resumed stream are aligned as in an uninterrupted one,
+		# none left if the saved state holds all snapshots)
+		n_batch = self._n_snapshots_batch
+		if n_batch == 'auto':
+			n_batch = self._stream['dn']
+		n_batch = max(1, min(int(n_batch), self._nt))
+		reads = [(max(t_0, t_start), min(t_0+n_batch, self._nt))
+			for t_0 in range(t_start // n_batch * n_batch, self._nt, n_batch)]
+		reads = [(t_0, t_end) for t_0, t_end in reads if t_0 < t_end]
+
+		# read the next snapshots on a background thread if required
+		if self._prefetch_depth > 0:
+			self._prefetcher = utils_async.Prefetcher(
+				self._read_data, reads, self._prefetch_depth)
+		try:
+			for t_0, t_end in reads:
+
+				# get new snapshots [n_batch, n_points]
+				if self._prefetcher is not None:
+					X_new = self._prefetcher.get((t_0, t_end))
+				else:
+					X_new = self._read_data(t_0, t_end)
+				self._ingest(np.reshape(X_new, (t_end-t_0, self._nx*self._nv)))
+		finally:
+			# stop reading ahead
+			if self._prefetcher is not None:
+				self._prefetcher.close()
+				self._prefetcher = None
+
+		print('--> Data stream ended.')
+		self.finalize()
+
+		# delete the state saved to checkpoint the stream
+		if self._stream_checkpoint > 0 and os.path.exists(self.state_path):
+			os.remove(self.state_path)
+		print('Elapsed time: ', time.time() - start, 's.')
+		return self
+
+
+
+	def partial_fit(self, snapshots):
+		"""
+		Update the SPOD with new snapshots, in order of time.
+
+		:param numpy.ndarray snapshots: new snapshots [n, x_1, ..., x_n,
+			n_variables] (or a single snapshot [x_1, ..., x_n, n_variables]).
+
+		:return: the SPOD object, with the eigenvalues of the
+			current basis (see also `get_current_modes_at_freq`).
+		:rtype: SPOD_streaming
+		"""
+		if getattr(self, '_stream', None) is None:
+			print(' ')
+			print('Calculating temporal DFT (streaming, partial fit)')
+			print('------------------------------------')
+			self._init_stream()
+		X_new = np.reshape(snapshots, (-1, self._nx*self._nv))
+		self._ingest(X_new)
+		return self
+
+
+
+	def finalize(self):
+		"""
+		Save eigenvalues and modes of the current basis into files.
+
+		:return: the SPOD object.
+		:rtype: SPOD_streaming
+		"""
+		if getattr(self, '_stream', None) is None:
+			raise ValueError('No snapshots streamed. Consider running partial_fit()')
+
+		# rescale such that <U_i,U_j>_E = U_i^H*W*U_j = delta_ij
+		X_SPOD = self._stream['U_hat'] * (1 / self._stream['sqrtW'])
+
+		# save results into files
+		self._eigs = self._stream['S_hat'].T.copy()
+		self._modes = dict()
+		file = os.path.join(self._save_dir,'spod_energy')
+		np.savez(file, eigs=self._eigs, f=self._freq)
+		for iFreq in range(0,self._n_freq):
+			Psi = self._expand(X_SPOD[iFreq]).reshape(
+				self._xshape+(self._nv,)+(self._n_modes_save,))
+			file_psi = os.path.join(self._save_dir,'modes1to{:04d}_freq{:04d}.npy'.format(self._n_modes_save,iFreq))
+			self.write(np.save, file_psi, Psi)
+			self._modes[iFreq] = file_psi
+		self.wait_writes()
+		return self
+
+
+
+	def get_current_modes_at_freq(self, freq_idx):
+		"""
+		Get the modes of the current basis (while streaming) at a frequency.
+
+		:param int freq_idx: frequency index.
+
+		:return: modes [x_1, ..., x_n, n_variables, n_modes_save].
+		:rtype: numpy.ndarray
+		"""
+		if getattr(self, '_stream', None) is None:
+			raise ValueError('No snapshots streamed. Consider running partial_fit()')
+		Psi = self._stream['U_hat'][freq_idx] * (1 / self._stream['sqrtW'])
+		return self._expand(Psi).reshape(
+			self._xshape+(self._nv,)+(self._n_modes_save,))
+
+
+
+	@property
+	def state_path(self):
+		'''
+		Get the path of the saved state of the stream.
+
+		:return: path of the saved state.
+		:rtype: str
+		'''
+		return os.path.join(self._save_dir, 'streaming_state.npz')
+
+
+
+	def _state_key(self):
+		"""Get the parameters the state depends on, as a JSON string."""
+		weights = np.ascontiguousarray(self._weights, dtype=float)
+		window = np.ascontiguousarray(self._window, dtype=float)
+		return json.dumps({
+			'n_DFT': self._n_DFT,
+			'n_overlap': self._n_overlap,
+			'n_freq': self._n_freq,
+			'n_points': self._n_points,
+			'n_modes_save': self._n_modes_save,
+			'one_sided': bool(self._isrealx),
+			'weights': hashlib.sha1(weights).hexdigest(),
+			'window': hashlib.sha1(window).hexdigest()}, sort_keys=True)
+
+
+
+	def save_state(self, path=None):
+		"""
+		Save the state of the stream, atomically (written to a temporary
+		file that then replaces `path`).
+
+		:param str path: path of the state file. Default is `state_path`.
+		"""
+		if self._stream is None:
+			raise ValueError('No snapshots streamed. Consider running partial_fit()')
+		if path is None:
+			path = self.state_path
+		state = {item: self._stream[item] for item in self.STATE_ITEMS}
+		tmp = path + '.tmp'
+		with open(tmp, 'wb') as f:
+			np.savez(f, version=self.STATE_VERSION, key=self._state_key(), **state)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, path)
+
+
+
+	def load_state(self, path=None):
+		"""
+		Load the state of the stream saved by `save_state`, to continue
+		the stream with `partial_fit` (or `fit`, with `resume` True).
+
+		:param str path: path of the state file. Default is `state_path`.
+		"""
+		if path is None:
+			path = self.state_path
+		with np.load(path) as f:
+			if int(f['version']) != self.STATE_VERSION:
+				raise ValueError('State version', int(f['version']), 'not supported.')
+			if str(f['key']) != self._state_key():
+				raise ValueError('State saved with different parameters.')
+			state = {item: f[item] for item in self.STATE_ITEMS}
+		self._init_stream()
+		for item in ['n_mu', 'block_i', 'ti']:
+			state[item] = int(state[item])
+		self._stream.update(state)
+		self._eigs = self._stream['S_hat'].T.copy()
+		return self
+
+
+
+	def _init_stream(self):
+		"""Initialize the state of the stream."""
 
 		# separation between adjacent blocks
 		dn = self._n_DFT - self._n_overlap
@@ -39,27 +257,9 @@ class SPOD_streaming(SPOD_base):
 		n_blocks_parallel = int(np.ceil(self._n_DFT/dn))
 
 		# sliding, relative time index for each block
-		t_idx = np.zeros([n_blocks_parallel,1],dtype=int)
-		for block_i in range(0,n_blocks_parallel):
-			t_idx[block_i] =  t_idx[block_i] - (block_i) * dn
-
-		print(' ')
-		print('Calculating temporal DFT (streaming)')
-		print('------------------------------------')
-
-		# obtain first snapshot to determine data size
-		# x_new = self._X[0]
-		x_new = self._data_handler(self._data, t_0=0, t_end=0, variables=self._variables)
-		x_new = np.reshape(x_new,(self._nx*self._nv,1))
-
-		# allocate data arrays
-		X_hat = np.zeros([self._nv*self._nx,self._n_freq], dtype='complex_')
-		X_sum = np.zeros([self._nv*self._nx,self._n_freq,n_blocks_parallel], dtype='complex_')
-		X_SPOD = np.zeros([self._nv*self._nx,self._n_freq,self._n_modes_save], dtype='complex_')
-		U_hat = np.zeros([self._nv*self._nx,self._n_freq,self._n_modes_save], dtype='complex_')
-		mu = np.zeros([self._nv*self._nx,1], dtype='complex_')
-		self._eigs = np.zeros([self._n_modes_save,self._n_freq], dtype='complex_')
-		self._modes = dict()
+		t_idx = np.zeros([n_blocks_parallel],dtype=int)
+		for block_j in range(0,n_blocks_parallel):
+			t_idx[block_j] =  t_idx[block_j] - (block_j) * dn
 
 		# DFT matrix
 		Fourier = np.fft.fft(np.identity(self._n_DFT))
@@ -70,136 +270,159 @@ class SPOD_streaming(SPOD_base):
 			freq_idx = np.arange(0,int(self._n_DFT/2+1))
 			Fourier = Fourier[:,freq_idx]
 
-		# convergence tests
-		mse_prev = np.empty([int(1e3),self._n_modes_save,self._n_freq], dtype='complex_') * np.nan
-		proj_prev = np.empty([self._n_freq,int(1e3),self._n_modes_save], dtype='complex_') * np.nan
-		S_hat_prev = np.zeros([self._n_modes_save,self._n_freq], dtype='complex_')
-
-		# initialize counters
-		block_i = 0
-		ti = -1
-		z = np.zeros([1,self._n_modes_save])
-		while True:
-			ti = ti + 1
-
-			# Get new snapshot and abort if data stream runs dry
-			if ti > 0:
-				try:
-					x_new = self._data_handler(self._data, t_0=ti, t_end=ti, variables=self._variables)
-					# x_new = self._X[ti]
-					x_new = np.reshape(x_new,(self._nx*self._nv,1))
-				except:
-					print('--> Data stream ended.')
-					break
-
-			# Update sample mean
-			mu_old = mu
-			mu = (ti * mu_old + x_new) / (ti + 1)
-
-			# Update incomplete Fourier sums, eqn (17)
+		# windowed Fourier rows (one per time index in the block), and
+		# their sum, giving the contribution of the mean to a Fourier sum
+		Fourier_win = self._window * Fourier
+
+		self._stream = {
+			# sqrt of weights
+			'sqrtW': np.sqrt(self._weights),
+			'dn': dn,
+			'Fourier_win': Fourier_win,
+			'Fourier_win_sum': np.sum(Fourier_win, axis=0),
+			# incomplete Fourier sums and their time index
+			't_idx': t_idx,
+			'X_sum': np.zeros([n_blocks_parallel,self._n_points,self._n_freq], dtype='complex_'),
+			# sample mean and number of snapshots in it
+			'mu': np.zeros([self._n_points,1], dtype='complex_'),
+			'n_mu': 0,
+			# basis and singular values
+			'U_hat': np.zeros([self._n_freq,self._n_points,self._n_modes_save], dtype='complex_'),
+			'S_hat': np.zeros([self._n_modes_save,self._n_freq], dtype='complex_'),
+			# counters of blocks and snapshots
+			'block_i': 0,
+			'ti': -1,
+			# convergence tests (of the last update)
+			'proj': None,
+			'mse': None}
+		self._eigs = self._stream['S_hat'].T.copy()
+		self._modes = dict()
+
+
+
+	def _ingest(self, X_new):
+		"""
+		Add new snapshots `X_new` [n, nx*nv] to the incomplete Fourier
+		sums, and update the basis for each sum completed.
+		"""
+		st = self._stream
+		X_new = self._compress(X_new)
+		self._check_finite(X_new, st['ti'] + 1)
+		t_idx = st['t_idx']
+		n_blocks_parallel = t_idx.shape[0]
+
+		# snapshots (row of the batch, time index in the block) to add
+		# to each incomplete Fourier sum, and first row not in the mean
+		rows = [[] for block_j in range(0,n_blocks_parallel)]
+		row_mu = 0
+		n_rows = X_new.shape[0]
+		for row in range(0, n_rows):
+			st['ti'] = st['ti'] + 1
+
+			# check if a sum is completed, and if so, initiate update
 			update = False
 			for block_j in range(0,n_blocks_parallel):
 				if t_idx[block_j] > -1:
-					X_sum[:,:,block_j] = X_sum[:,:,block_j] + self._window[t_idx[block_j]] \
-						* Fourier[t_idx[block_j],:] * x_new
-
-				# check if sum is completed, and if so, initiate update
+					rows[block_j].append((row, int(t_idx[block_j])))
 				if t_idx[block_j] == self._n_DFT-1:
 					update = True
-					X_hat = X_sum[:,:,block_j].copy()
-					X_sum[:,:,block_j] = 0
-					t_idx[block_j] = min(t_idx) - dn
+					block_done = block_j
+					t_idx[block_j] = t_idx.min() - st['dn']
 				else:
 					t_idx[block_j] = t_idx[block_j] + 1
+			if not update and row < n_rows-1:
+				continue
+
+			# Update sample mean and incomplete Fourier sums, eqn (17),
+			# with the snapshots of the batch up to the present one
+			st['mu'] = (st['n_mu'] * st['mu'] \
+				+ np.sum(X_new[row_mu:row+1], axis=0)[:,np.newaxis]) \
+				/ (st['n_mu'] + row + 1 - row_mu)
+			st['n_mu'] = st['n_mu'] + row + 1 - row_mu
+			row_mu = row + 1
+			for block_j in range(0,n_blocks_parallel):
+				if rows[block_j]:
+					r, t = np.array(rows[block_j]).T
+					st['X_sum'][block_j] += np.matmul(X_new[r].T, st['Fourier_win'][t])
+					rows[block_j] = []
+			if not update:
+				continue
+			X_hat = st['X_sum'][block_done].copy()
+			st['X_sum'][block_done] = 0
 
 			# Update basis if a Fourier sum is completed
-			if update:
-				block_i = block_i + 1
-
-				# subtract mean contribution to Fourier sum
-				for row_idx in range(0,self._n_DFT):
-					X_hat = X_hat - (self._window[row_idx] * Fourier[row_idx,:]) * mu
-
-				# correct for windowing function and apply 1/self._n_DFT factor
-				X_hat = self._winWeight / self._n_DFT * X_hat
-
-				if block_i == 0:
-					# initialize basis with first vector
-					print('--> Initializing left singular vectors', 'Time ', str(ti), ' / block ', str(block_i))
-					U_hat[:,:,0] = X_hat * sqrtW
-					self._eigs[0,:] = np.sum(abs(U_hat[:,:,0]**2))
-				else:
-					# update basis
-					print('--> Updating left singular vectors', 'Time ', str(ti), ' / block ', str(block_i))
-					S_hat_prev  = self._eigs.copy()
-					for iFreq in range(0,self._n_freq):
-
-						# new data (weighted)
-						x = X_hat[:,[iFreq]] * sqrtW[:]
-						# old basis
-						U = np.squeeze(U_hat[:,iFreq,:])
-						# old singular values
-						S = np.diag(np.squeeze(self._eigs[:,iFreq]))
-						# product U^H*x needed in eqns. (27,32)
-						Ux = np.matmul(U.conj().T, x)
-						# orthogonal complement to U, eqn. (27)
-						u_p = x - np.matmul(U, Ux)
-						# norm of orthogonal complement
-						abs_up = np.sqrt(np.matmul(u_p.conj().T, u_p))
-						# normalized orthogonal complement
-						u_new = u_p / abs_up
-
-						# build K matrix and compute its SVD, eqn. (32)
-						K_1 = np.hstack((np.sqrt(block_i+2) * S, Ux))
-						K_2 = np.hstack((z, abs_up))
-						K = np.vstack((K_1, K_2))
-						K = np.sqrt((block_i+1)/ (block_i+2)**2) * K
-
-						# calculate partial svd
-						Up, Sp, _ = la.svd(K, full_matrices=False)
-
-						# update U as in eqn. (33)
-						# for simplicity, we could not rotate here and instead
-						# update U<-[U p] and Up<-[Up 0;0 1]*Up and rotate later;
-						# see Brand (LAA ,2006, section 4.1)
-						U_tmp = np.hstack((U, u_new))
-						U = np.dot(U_tmp, Up)
-
-						# best rank-k approximation, eqn. (37)
-						U_hat[:,iFreq,:] = U[:,0:self._n_modes_save]
-						self._eigs[:,iFreq] = Sp[0:self._n_modes_save]
-
-					# reset Fourier sum
-					X_hat[:,:] = 0
-
-				X_SPOD_prev = X_SPOD
-				X_SPOD = U_hat * (1 / sqrtW[:,:,np.newaxis])
-
-				# Convergence
-				for iFreq in range(0,self._n_freq):
-					proj_iFreq = np.matmul((np.squeeze(X_SPOD_prev[:,iFreq,:]) * self._weights).conj().T, \
-										 np.squeeze(X_SPOD[:,iFreq,:]))
-					proj_prev[iFreq,block_i,:] = np.amax(np.abs(proj_iFreq), axis=0)
-				mse_prev[block_i,:,:] = (np.abs(S_hat_prev**2 - self._eigs**2)**2) / (S_hat_prev**2)
-
-		# rescale such that <U_i,U_j>_E = U_i^H*W*U_j = delta_ij
-		X_SPOD = U_hat[:,:,0:self._n_modes_save] *  (1 / sqrtW[:,:,np.newaxis])
-
-		# shuffle and reshape
-		X_SPOD = np.einsum('ijk->jik', X_SPOD)
-		X_SPOD = np.reshape(X_SPOD, (self._n_freq,)+self._xshape+(self._nv,)+(self._n_modes_save,))
-
-		# save eigenvalues
-		self._eigs = self._eigs.T
-
-		# save results into files
-		file = os.path.join(self._save_dir,'spod_energy')
-		np.savez(file, eigs=self._eigs, f=self._freq)
-		for iFreq in range(0,self._n_freq):
-			Psi = X_SPOD[iFreq,...]
-			file_psi = os.path.join(self._save_dir,'modes1to{:04d}_freq{:04d}.npy'.format(self._n_modes_save,iFreq))
-			np.save(file_psi, Psi)
-			self._modes[iFreq] = file_psi
-
-		print('Elapsed time: ', time.time() - start, 's.')
-		return self
+			self._update_basis(X_hat)
+
+			# save state every `stream_checkpoint_blocks` blocks
+			if self._stream_checkpoint > 0 \
+				and st['block_i'] % self._stream_checkpoint == 0:
+				self.save_state()
+		self._eigs = st['S_hat'].T.copy()
+
+
+
+	def _update_basis(self, X_hat):
+		"""Update the basis with the completed Fourier sum `X_hat` [n_points, n_freq]."""
+		st = self._stream
+		st['block_i'] = st['block_i'] + 1
+		block_i = st['block_i']
+		ti = st['ti']
+		sqrtW = st['sqrtW']
+		U_hat = st['U_hat']
+
+		# subtract mean contribution to Fourier sum (rank-one update)
+		X_hat -= st['mu'] * st['Fourier_win_sum']
+
+		# correct for windowing function and apply 1/self._n_DFT factor
+		X_hat = self._winWeight / self._n_DFT * X_hat
+
+		S_hat_prev = st['S_hat'].copy()
+		U_hat_prev = U_hat.copy()
+		if block_i == 0:
+			# initialize basis with first vector
+			print('--> Initializing left singular vectors', 'Time ', str(ti), ' / block ', str(block_i))
+			U_hat[:,:,0] = (X_hat * sqrtW).T
+			st['S_hat'][0,:] = np.sum(abs(U_hat[:,:,0]**2))
+		else:
+			# update basis, for all frequencies at once
+			print('--> Updating left singular vectors', 'Time ', str(ti), ' / block ', str(block_i))
+			n_modes = self._n_modes_save
+
+			# new data (weighted) [n_freq, n_points, 1]
+			x = (X_hat * sqrtW).T[:,:,np.newaxis]
+			# product U^H*x needed in eqns. (27,32)
+			Ux = np.matmul(U_hat.conj().transpose(0,2,1), x)
+			# orthogonal complement to U, eqn. (27)
+			u_p = x - np.matmul(U_hat, Ux)
+			# norm of orthogonal complement
+			abs_up = np.sqrt(np.matmul(u_p.conj().transpose(0,2,1), u_p))
+			# normalized orthogonal complement
+			u_new = u_p / abs_up
+
+			# build K matrices and compute their SVD, eqn. (32)
+			K = np.zeros([self._n_freq,n_modes+1,n_modes+1], dtype='complex_')
+			idx = np.arange(0,n_modes)
+			K[:,idx,idx] = np.sqrt(block_i+2) * st['S_hat'].T
+			K[:,0:n_modes,n_modes] = Ux[:,:,0]
+			K[:,n_modes,n_modes] = abs_up[:,0,0]
+			K = np.sqrt((block_i+1)/ (block_i+2)**2) * K
+
+			# calculate partial svd
+			Up, Sp, _ = la.svd(K, full_matrices=False)
+
+			# update U as in eqn. (33)
+			# for simplicity, we could not rotate here and instead
+			# update U<-[U p] and Up<-[Up 0;0 1]*Up and rotate later;
+			# see Brand (LAA ,2006, section 4.1)
+			U = np.matmul(np.concatenate((U_hat, u_new), axis=2), Up)
+
+			# best rank-k approximation, eqn. (37)
+			U_hat[...] = U[:,:,0:n_modes]
+			st['S_hat'][...] = Sp[:,0:n_modes].T
+
+		# Convergence: projection of the new basis on the previous
+		# one (in the weighted inner product, i.e. U_prev^H * U)
+		proj = np.matmul(U_hat_prev.conj().transpose(0,2,1), U_hat)
+		st['proj'] = np.amax(np.abs(proj), axis=1)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			st['mse'] = (np.abs(S_hat_prev**2 - st['S_hat']**2)**2) / (S_hat_prev**2)
@@ -0,0 +1,174 @@
+"""Derived module from spod_base.py for SPOD tiled."""
+
+# Import standard Python packages
+import os
+import time
+import numpy as np
+import psutil
+from tqdm import tqdm
+
+
+# Import PySPOD base class for SPOD_tiled
+from pyspod.spod_base import SPOD_base
+
+CWD = os.getcwd()
+BYTE_TO_GB = 9.3132257461548e-10
+
+
+
+class SPOD_tiled(SPOD_base):
+	"""
+	Class that implements the Spectral Proper Orthogonal Decomposition
+	to the input data processing the spatial domain in tiles, for
+	datasets whose FFT blocks do not fit in RAM (nor, transposed, on disk).
+
+	The time FFT is independent at each point, and the cross-spectral
+	density matrix of each frequency is a sum over tiles of points,
+	M_f = sum_tiles Q_tile^H W_tile Q_tile. The domain is split into
+	tiles of points fitting the memory budget `tile_memory_gb`; for each
+	tile the snapshots are read, the FFT blocks of the tile computed and
+	M_f accumulated for all frequencies. After the eigendecompositions,
+	the FFT blocks of each tile are computed again to build the modes,
+	written tile by tile into the mode files. No array of the size of
+	the whole domain is held, and the data of each tile is read twice.
+	Data handlers providing `read_points` (preloaded arrays and
+	`MemmapReader`) read only the points of the tile; others read whole
+	snapshots, `n_snapshots_chunk` at a time, from which the points of
+	the tile are kept. The longtime mean is computed tile by tile too,
+	from the snapshots of the tile (the separate pass over the data of
+	the other algorithms, reading whole snapshots, is skipped).
+	FFT blocks are not saved (`savefft`, `reuse_blocks` and `resume`
+	are ignored).
+
+	The computation is performed on the data *X* passed
+	to the constructor of the `SPOD_tiled` class, derived
+	from the `SPOD_base` class.
+	"""
+
+	def fit(self):
+		"""
+		Class-specific method to fit the data matrix X using
+		the SPOD tiled algorithm.
+		"""
+		start = time.time()
+
+		print(' ')
+		print('Calculating cross-spectral density (tiled)')
+		print('------------------------------------')
+
+		# number of points per tile and of snapshots per read, such that
+		# the tile (snapshots, blocks and modes) takes 3/4 of the memory
+		# budget, and the snapshots read at once (whole, if the data
+		# handler does not read points) the remaining 1/4
+		gb_tile = self._tile_memory
+		if gb_tile == 'auto':
+			gb_tile = 0.25 * psutil.virtual_memory()[1] * BYTE_TO_GB
+		gb_point = (self._nt * 16 + self._n_freq \
+			* (self._n_blocks + self._n_modes_save) * 16) * BYTE_TO_GB
+		self._n_points_tile = max(1, min(self._n_points, int(0.75 * gb_tile / gb_point)))
+		gb_snapshot = self._nx * self._nv * 16 * BYTE_TO_GB
+		self._n_snapshots_chunk = max(1, min(self._nt, int(0.25 * gb_tile / gb_snapshot)))
+		tiles = [(iPoint, min(iPoint+self._n_points_tile, self._n_points))
+			for iPoint in range(0, self._n_points, self._n_points_tile)]
+		print('- Memory budget of tiles ~', gb_tile, 'GB')
+		print('- Points per tile         ', self._n_points_tile, '(', len(tiles), 'tiles )')
+
+		# accumulate the cross-spectral density matrices over tiles
+		M = np.zeros([self._n_freq, self._n_blocks, self._n_blocks], dtype='complex_')
+		for tile in tqdm(tiles, desc='accumulating tiles'):
+			Q_hat_tile = self._tile_blocks(tile)
+			weights = self._weights[tile[0]:tile[1]]
+			for iFreq in range(0, self._n_freq):
+				Q_hat_f = Q_hat_tile[iFreq]
+				M[iFreq] += np.matmul(Q_hat_f.conj().T, Q_hat_f * weights)
+			del Q_hat_tile
+		M /= self._n_blocks
+		print('------------------------------------')
+
+
+
+		# eigendecompositions and modes, built tile by tile
+		print(' ')
+		print('Calculating SPOD (tiled)')
+		print('------------------------------------')
+		self._eigs = np.zeros([self._n_freq, self._n_eigs], dtype='complex_')
+		self._modes = dict()
+		V_save = np.empty([self._n_freq, self._n_blocks, self._n_modes_save], dtype='complex_')
+		for iFreq in tqdm(range(0, self._n_freq), desc='computing frequencies'):
+			L,V = self.eig_solve(M[iFreq])
+			L_save = L[0:self._n_modes_save]
+			V_save[iFreq] = V[:,0:self._n_modes_save] \
+				/ (np.sqrt(abs(L_save)) * np.sqrt(self._n_blocks))
+			self._store_eigs(abs(L[0:self._n_eigs]), iFreq)
+
+			# create mode file, filled tile by tile below
+			file_psi = os.path.join(self._save_dir_blocks,
+				'modes1to{:04d}_freq{:04d}.npy'.format(self._n_modes_save, iFreq))
+			np.lib.format.open_memmap(file_psi, mode='w+', dtype='complex_',
+				shape=self._xshape+(self._nv,)+(self._n_modes_save,))
+			self._modes[iFreq] = file_psi
+		del M
+
+		for tile in tqdm(tiles, desc='computing modes'):
+			Q_hat_tile = self._tile_blocks(tile)
+			idx = self._tile_index(tile)
+			for iFreq in range(0, self._n_freq):
+				Psi = np.lib.format.open_memmap(self._modes[iFreq], mode='r+')
+				Psi.reshape(self._nx*self._nv, self._n_modes_save)[idx] = \
+					np.matmul(Q_hat_tile[iFreq], V_save[iFreq])
+				Psi.flush()
+				del Psi
+			del Q_hat_tile
+
+		# store and save results
+		self.store_and_save()
+		print('------------------------------------')
+		print(' ')
+		print('Results saved in folder ', self._save_dir_blocks)
+		print('Elapsed time: ', time.time() - start, 's.')
+		return self
+
+
+
+	def longtime_mean(self):
+		"""Get longtime mean: computed for each tile from its snapshots (see `_tile_blocks`)."""
+		return 0
+
+
+
+	def _tile_index(self, tile):
+		"""Get the indices in the full grid [nx*nv] of the points of `tile`."""
+		if self._mask_idx is None:
+			return np.s_[tile[0]:tile[1]]
+		return self._mask_idx[tile[0]:tile[1]]
+
+
+
+	def _tile_blocks(self, tile):
+		"""
+		Get the FFT blocks [n_freq, n_points_tile, n_blocks] of the points
+		of `tile`, reading the snapshots `n_snapshots_chunk` at a time.
+		"""
+		idx = self._tile_index(tile)
+		X_tile = None
+		for t_0 in range(0, self._nt, self._n_snapshots_chunk):
+			t_end = min(t_0 + self._n_snapshots_chunk, self._nt)
+			X = self._read_points(t_0, t_end, idx)
+			self._check_finite(X, t_0, idx)
+			if X_tile is None:
+				X_tile = np.empty([self._nt, X.shape[1]], dtype=X.dtype)
+			X_tile[t_0:t_end] = X
+			self._n_snapshots_read += t_end - t_0
+
+		# mean of the tile
+		if self._mean_type.lower() == 'longtime':
+			x_mean = np.mean(X_tile, axis=0)
+		else:
+			x_mean = self._x_mean
+
+		Q_hat_tile = np.empty([self._n_freq, X_tile.shape[1], self._n_blocks], dtype='complex_')
+		for iBlk in range(0, self._n_blocks):
+			offset = self._block_offset(iBlk)
+			Q_blk = self._center_block(X_tile[offset:offset+self._n_DFT], x_mean)
+			Q_hat_tile[:,:,iBlk] = self._fft_blocks(Q_blk)
+		return Q_hat_tile
@@ -0,0 +1,150 @@
+"""Module implementing utils for asynchronous I/O (prefetch and write-behind)."""
+
+# import standard python packages
+import queue
+import threading
+
+
+
+class Prefetcher(object):
+	'''
+	Read items ahead of their use on a background thread, so that reading
+	the next item overlaps with the computation on the current one. Items
+	are returned by `get` in the order of `keys`; errors raised while
+	reading an item are raised by the `get` of that item.
+
+	:param callable fetch: function reading one item, called as `fetch(*key)`.
+	:param iterable keys: keys (tuples) of the items, in order of use.
+	:param int depth: maximum number of items read ahead, bounding the
+		memory held by the prefetcher. Default is 1.
+	'''
+
+	_END = object()
+
+	def __init__(self, fetch, keys, depth=1):
+		self._queue = queue.Queue(maxsize=max(1, int(depth)))
+		self._stop = threading.Event()
+		self._thread = threading.Thread(
+			target=self._run, args=(fetch, keys), daemon=True)
+		self._thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _put(self, item):
+		while not self._stop.is_set():
+			try:
+				self._queue.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def _run(self, fetch, keys):
+		for key in keys:
+			if self._stop.is_set():
+				return
+			try:
+				item = (key, fetch(*key), None)
+			except BaseException as e:
+				item = (key, None, e)
+			if not self._put(item) or item[2] is not None:
+				return
+		self._put((self._END, None, None))
+
+	def get(self, key=None):
+		'''
+		Get the next item.
+
+		:param tuple key: if specified, expected key of the next item.
+
+		:return: the item.
+		'''
+		item_key, item, error = self._queue.get()
+		if error is not None:
+			raise error
+		if item_key is self._END:
+			raise StopIteration('No more items to prefetch.')
+		if key is not None and tuple(key) != tuple(item_key):
+			raise RuntimeError(
+				'Prefetched item', item_key, 'does not match requested', key)
+		return item
+
+	def close(self):
+		'''Stop reading ahead and release the items not consumed.'''
+		self._stop.set()
+		while self._thread.is_alive():
+			try:
+				self._queue.get(timeout=0.1)
+			except queue.Empty:
+				pass
+		self._thread.join()
+
+
+
+class AsyncWriter(object):
+	'''
+	Write-behind queue: write calls submitted by `submit` are run in order
+	on a background thread, so that the computation does not wait on the
+	filesystem. The first error raised by a write is raised in the caller
+	by the next `submit` or `wait`; writes still pending when it occurred
+	are dropped.
+
+	:param int depth: maximum number of pending writes, bounding the
+		memory held by the queue (`submit` blocks when full). Default is 4.
+	'''
+
+	def __init__(self, depth=4):
+		self._queue = queue.Queue(maxsize=max(1, int(depth)))
+		self._error = None
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def _run(self):
+		while True:
+			task = self._queue.get()
+			try:
+				if task is None:
+					return
+				if self._error is None:
+					func, args, kwargs = task
+					func(*args, **kwargs)
+			except BaseException as e:
+				self._error = e
+			finally:
+				self._queue.task_done()
+
+	def _raise_error(self):
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise error
+
+	def submit(self, func, *args, **kwargs):
+		'''
+		Submit the write `func(*args, **kwargs)`. Arguments must not be
+		modified by the caller until the write is done.
+		'''
+		self._raise_error()
+		self._queue.put((func, args, kwargs))
+
+	def wait(self):
+		'''Wait for all pending writes, and raise their error if any.'''
+		self._queue.join()
+		self._raise_error()
+
+	def close(self):
+		'''Wait for all pending writes and stop the writer thread.'''
+		if self._thread.is_alive():
+			self._queue.join()
+			self._queue.put(None)
+			self._thread.join()
+		self._raise_error()
@@ -0,0 +1,417 @@
+"""Module implementing the storage of FFT blocks."""
+
+# import standard python packages
+import os
+import json
+import zlib
+import hashlib
+import h5py
+import numpy as np
+
+
+BYTE_TO_GB = 9.3132257461548e-10
+
+
+
+class BlockStore(object):
+	'''
+	Store of the FFT blocks of a SPOD analysis in a single chunked HDF5
+	file. Blocks are stored either in a frequency-major layout, i.e. a
+	dataset `Q_hat` of shape [n_freq, n_points, n_blocks], or in a
+	block-major layout, i.e. [n_blocks, n_freq, n_points].
+
+	In the frequency-major layout chunks hold by default one frequency
+	and one block (split along the points if too large): each block is
+	written with one contiguous chunk per frequency, and each frequency
+	is read with one chunk per block. The block-major layout is used as
+	staging area, where each block is written contiguously, to be then
+	transposed (see `transpose`) into a frequency-major store whose chunks
+	hold all blocks, so that each frequency is read sequentially.
+
+	:param str path: path of the HDF5 file.
+	:param int n_freq: number of frequencies.
+	:param int n_points: number of (flattened) spatial points times variables.
+	:param int n_blocks: number of blocks.
+	:param str compression: HDF5 compression filter ('gzip', 'lzf') or None.
+	:param int compression_opts: options of the compression filter
+		(e.g. gzip level). Default is None.
+	:param str layout: 'frequency' (frequency-major) or 'block' (block-major).
+		Default is 'frequency'.
+	'''
+
+	# maximum number of points per chunk (16 MB of double complex)
+	MAX_CHUNK_POINTS = 2**20
+
+	def __init__(self, path, n_freq, n_points, n_blocks,
+		compression=None, compression_opts=None, layout='frequency'):
+		if layout not in ['frequency', 'block']:
+			raise ValueError(layout, 'not recognized.')
+		self._path = path
+		self._n_freq = int(n_freq)
+		self._n_points = int(n_points)
+		self._n_blocks = int(n_blocks)
+		self._compression = compression
+		self._compression_opts = compression_opts
+		self._layout = layout
+		if layout == 'frequency':
+			self._shape = (self._n_freq, self._n_points, self._n_blocks)
+		else:
+			self._shape = (self._n_blocks, self._n_freq, self._n_points)
+		self._file = None
+
+	@property
+	def path(self):
+		'''
+		Get the path of the HDF5 file.
+
+		:return: path of the HDF5 file.
+		:rtype: str
+		'''
+		return self._path
+
+	def exists(self):
+		'''
+		Check whether the store exists on disk with the expected shape.
+
+		:return: True if the file exists and holds blocks of the expected shape.
+		:rtype: bool
+		'''
+		if not os.path.exists(self._path):
+			return False
+		try:
+			with h5py.File(self._path, 'r') as f:
+				return f['Q_hat'].shape == self._shape
+		except (OSError, KeyError):
+			return False
+
+	def create(self, n_blocks_chunk=1):
+		'''
+		Create an empty store, replacing any existing file.
+
+		:param int n_blocks_chunk: number of blocks per chunk, for the
+			frequency-major layout. Default is 1.
+		'''
+		self.close()
+		if self._layout == 'frequency':
+			n_blocks_chunk = min(int(n_blocks_chunk), self._n_blocks)
+			chunk_points = max(1, min(self._n_points,
+				self.MAX_CHUNK_POINTS // n_blocks_chunk))
+			chunks = (1, chunk_points, n_blocks_chunk)
+		else:
+			chunks = (1, 1, min(self._n_points, self.MAX_CHUNK_POINTS))
+		self._file = h5py.File(self._path, 'w')
+		self._file.create_dataset('Q_hat', shape=self._shape, dtype='complex_',
+			chunks=chunks, compression=self._compression,
+			compression_opts=self._compression_opts)
+		self._file.create_dataset('blocks_done', shape=(self._n_blocks,), dtype=bool)
+		return self
+
+	def open(self, mode='r'):
+		'''Open an existing store.'''
+		if self._file is None:
+			self._file = h5py.File(self._path, mode)
+		return self
+
+	def close(self):
+		'''Close the store.'''
+		if self._file is not None:
+			self._file.close()
+			self._file = None
+
+	def remove(self):
+		'''Close and delete the store.'''
+		self.close()
+		if os.path.exists(self._path):
+			os.remove(self._path)
+
+	def write_blocks(self, iBlk_start, Q_blks_hat):
+		'''
+		Write consecutive blocks starting at `iBlk_start`.
+
+		:param int iBlk_start: index of the first block.
+		:param numpy.ndarray Q_blks_hat: blocks [n_freq, n_points, n_blocks_written].
+		'''
+		iBlk_end = iBlk_start + Q_blks_hat.shape[-1]
+		if self._layout == 'frequency':
+			self._file['Q_hat'][:,:,iBlk_start:iBlk_end] = Q_blks_hat
+		else:
+			self._file['Q_hat'][iBlk_start:iBlk_end,:,:] = \
+				np.ascontiguousarray(np.moveaxis(Q_blks_hat, 2, 0))
+		self._file['blocks_done'][iBlk_start:iBlk_end] = True
+
+	def read_freq(self, iFreq):
+		'''
+		Read all blocks of frequency `iFreq`.
+
+		:param int iFreq: frequency index.
+
+		:return: blocks of the frequency [n_points, n_blocks].
+		:rtype: numpy.ndarray
+		'''
+		if self._layout == 'block':
+			return self._file['Q_hat'][:,iFreq,:].T
+		return self._file['Q_hat'][iFreq,:,:]
+
+	def read_freqs(self, iFreq_start, iFreq_end, out=None):
+		'''
+		Read all blocks of frequencies `iFreq_start` to `iFreq_end` (excluded).
+
+		:param numpy.ndarray out: if specified, array [iFreq_end-iFreq_start,
+			n_points, n_blocks] where blocks are read into.
+
+		:return: blocks of the frequencies [n_freq_read, n_points, n_blocks].
+		:rtype: numpy.ndarray
+		'''
+		dset = self._file['Q_hat']
+		if self._layout == 'block':
+			Q_hat = np.moveaxis(dset[:,iFreq_start:iFreq_end,:], 0, 2)
+			if out is None:
+				return Q_hat
+			out[...] = Q_hat
+			return out
+		if out is None:
+			return dset[iFreq_start:iFreq_end,:,:]
+		dset.read_direct(out, np.s_[iFreq_start:iFreq_end,:,:])
+		return out
+
+	def read_block(self, iBlk):
+		'''
+		Read all frequencies of block `iBlk`.
+
+		:param int iBlk: block index.
+
+		:return: block [n_freq, n_points].
+		:rtype: numpy.ndarray
+		'''
+		if self._layout == 'block':
+			return self._file['Q_hat'][iBlk,:,:]
+		return self._file['Q_hat'][:,:,iBlk]
+
+	def blocks_done(self):
+		'''
+		Get the blocks that have been written.
+
+		:return: boolean flag for each block.
+		:rtype: numpy.ndarray
+		'''
+		return self._file['blocks_done'][:]
+
+	def is_complete(self):
+		'''
+		Check whether all blocks have been written.
+
+		:return: True if all blocks are present.
+		:rtype: bool
+		'''
+		return bool(np.all(self.blocks_done()))
+
+	def write_mean(self, x_mean, key=None, subtracted=False):
+		'''
+		Store the longtime mean, marking the blocks as computed without it,
+		or, if `subtracted`, as computed with it (the mean is then stored
+		only to be loaded when resuming, instead of being recomputed).
+
+		:param numpy.ndarray x_mean: longtime mean [n_points].
+		:param str key: key of the blocks the mean refers to. Default is None.
+		:param bool subtracted: whether the mean is subtracted from the
+			blocks. Default is False.
+		'''
+		if 'x_mean' in self._file:
+			del self._file['x_mean']
+		dset = self._file.create_dataset('x_mean', data=x_mean)
+		dset.attrs['subtracted'] = bool(subtracted)
+		if key is not None:
+			dset.attrs['key'] = key
+
+	def read_mean(self, key=None, subtracted=False):
+		'''
+		Get the longtime mean if the blocks were computed without it, or,
+		if `subtracted`, the mean subtracted from the blocks.
+
+		:param str key: if specified, key of the blocks the mean must
+			refer to. Default is None.
+		:param bool subtracted: whether to get the mean subtracted from
+			the blocks. Default is False.
+
+		:return: the longtime mean [n_points], or None if not stored.
+		:rtype: numpy.ndarray
+		'''
+		if 'x_mean' not in self._file:
+			return None
+		dset = self._file['x_mean']
+		if bool(dset.attrs.get('subtracted', False)) != subtracted:
+			return None
+		if key is not None and dset.attrs.get('key') != key:
+			return None
+		return dset[:]
+
+	def write_sum(self, x_sum):
+		'''
+		Store the partial sum of the snapshots of the blocks written so far
+		(longtime mean fused with the blocks), to resume the block pass.
+
+		:param numpy.ndarray x_sum: partial sum of the snapshots [n_points].
+		'''
+		if 'x_sum' not in self._file:
+			self._file.create_dataset('x_sum', shape=x_sum.shape, dtype=x_sum.dtype)
+		self._file['x_sum'][...] = x_sum
+		self._file.flush()
+
+	def read_sum(self):
+		'''
+		Get the partial sum of the snapshots of the blocks written so far.
+
+		:return: the partial sum [n_points], or None if not stored.
+		:rtype: numpy.ndarray
+		'''
+		if 'x_sum' in self._file:
+			return self._file['x_sum'][:]
+		return None
+
+	def flush(self):
+		'''Flush the written blocks to disk.'''
+		self._file.flush()
+
+	def transpose(self, store, memory_gb):
+		'''
+		Out-of-core transpose of a block-major store into the frequency-major
+		`store`, whose chunks hold all blocks of a frequency (split along the
+		points if too large), so that each frequency is then read with one
+		sequential read. Groups of frequencies (or, if a single frequency does
+		not fit, of points) are read from all blocks into a buffer of at most
+		`memory_gb`, and written as contiguous frequency slabs.
+
+		:param BlockStore store: frequency-major store (created here).
+		:param float memory_gb: memory budget of the transpose buffer, in GB.
+
+		:return: the frequency-major store (open).
+		:rtype: BlockStore
+		'''
+		if self._layout != 'block' or store._layout != 'frequency':
+			raise ValueError('transpose requires a block-major store '
+				'and a frequency-major destination.')
+		store.create(n_blocks_chunk=self._n_blocks)
+		src = self._file['Q_hat']
+		dst = store._file['Q_hat']
+		chunk_points = dst.chunks[1]
+
+		# size of frequency and point groups fitting the memory budget
+		gb_freq = self._n_points * self._n_blocks * 16 * BYTE_TO_GB
+		n_freq_group = int(memory_gb / gb_freq)
+		if n_freq_group >= 1:
+			n_freq_group = min(n_freq_group, self._n_freq)
+			n_points_group = self._n_points
+		else:
+			n_freq_group = 1
+			n_points_group = int(memory_gb / (self._n_blocks * 16 * BYTE_TO_GB))
+			n_points_group = max(chunk_points, n_points_group // chunk_points * chunk_points)
+
+		for iFreq in range(0, self._n_freq, n_freq_group):
+			fs = np.s_[iFreq:min(iFreq+n_freq_group, self._n_freq)]
+			for iPoint in range(0, self._n_points, n_points_group):
+				ps = np.s_[iPoint:min(iPoint+n_points_group, self._n_points)]
+				n_f = fs.stop - fs.start
+				n_p = ps.stop - ps.start
+				buffer = np.empty([n_f, n_p, self._n_blocks], dtype='complex_')
+				Q_blk_hat = np.empty([n_f, n_p], dtype='complex_')
+				for iBlk in range(0, self._n_blocks):
+					src.read_direct(Q_blk_hat, np.s_[iBlk,fs,ps])
+					buffer[:,:,iBlk] = Q_blk_hat
+				dst[fs,ps,:] = buffer
+		store._file['blocks_done'][:] = self._file['blocks_done'][:]
+		if 'x_mean' in self._file:
+			dset = self._file['x_mean']
+			store.write_mean(dset[:], key=dset.attrs.get('key'),
+				subtracted=bool(dset.attrs.get('subtracted', False)))
+		return store
+
+
+
+def block_checksum(Q_blk_hat):
+	'''
+	Get the checksum (CRC32) of a block.
+
+	:param numpy.ndarray Q_blk_hat: block [n_freq, n_points].
+
+	:return: checksum of the block.
+	:rtype: int
+	'''
+	return zlib.crc32(np.ascontiguousarray(Q_blk_hat, dtype='complex_'))
+
+
+
+class BlockManifest(object):
+	'''
+	Manifest (JSON) indexing the content of a `BlockStore`. It records the
+	key of the blocks, i.e. a hash of the parameters they depend on and of
+	a fingerprint of the data, and the checksum of each block. The store
+	is reused only if its manifest holds the same key, so that checking
+	the cache costs one manifest read.
+
+	:param str path: path of the JSON file.
+	'''
+
+	# version of the blocks format (invalidates older caches)
+	VERSION = 1
+
+	def __init__(self, path):
+		self._path = path
+
+	@property
+	def path(self):
+		'''
+		Get the path of the JSON file.
+
+		:return: path of the JSON file.
+		:rtype: str
+		'''
+		return self._path
+
+	@staticmethod
+	def make_key(params, fingerprint):
+		'''
+		Get the key of blocks computed with `params` from data with `fingerprint`.
+
+		:param dict params: parameters the blocks depend on (JSON serializable).
+		:param dict fingerprint: fingerprint of the data (JSON serializable).
+
+		:return: the key (hexadecimal SHA-1 digest).
+		:rtype: str
+		'''
+		content = json.dumps({'version': BlockManifest.VERSION,
+			'params': params, 'fingerprint': fingerprint}, sort_keys=True)
+		return hashlib.sha1(content.encode()).hexdigest()
+
+	def read(self):
+		'''
+		Read the manifest.
+
+		:return: the manifest, or None if missing or unreadable.
+		:rtype: dict
+		'''
+		try:
+			with open(self._path, 'r') as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def write(self, key, params, fingerprint, checksums):
+		'''
+		Write the manifest (atomically).
+
+		:param str key: key of the blocks.
+		:param dict params: parameters the blocks depend on.
+		:param dict fingerprint: fingerprint of the data.
+		:param list checksums: checksum of each block.
+		'''
+		manifest = {'version': self.VERSION, 'key': key, 'params': params,
+			'fingerprint': fingerprint, 'checksums': [int(c) for c in checksums]}
+		tmp = self._path + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(manifest, f, indent=1)
+		os.replace(tmp, self._path)
+
+	def remove(self):
+		'''Delete the manifest.'''
+		if os.path.exists(self._path):
+			os.remove(self._path)
@@ -0,0 +1,100 @@
+"""Module implementing the checkpoint log of SPOD fits."""
+
+# import standard python packages
+import os
+import json
+import threading
+
+
+
+class CheckpointLog(object):
+	'''
+	Checkpoint log of a SPOD fit, in JSON-lines format: one entry is
+	appended (and flushed to disk) each time a batch of blocks or the
+	modes of a frequency are written, so that an interrupted fit can
+	resume from the results already in storage. Each entry records the
+	stage ('blocks' or 'freq') and the key of the results it refers to;
+	entries with a different key are ignored. A truncated last line,
+	left by an interrupted write, is ignored too.
+
+	:param str path: path of the log file.
+	'''
+
+	def __init__(self, path):
+		self._path = path
+		self._lock = threading.Lock()
+
+	@property
+	def path(self):
+		'''
+		Get the path of the log file.
+
+		:return: path of the log file.
+		:rtype: str
+		'''
+		return self._path
+
+	def read(self, stage, key):
+		'''
+		Read the entries of a stage.
+
+		:param str stage: stage of the entries ('blocks' or 'freq').
+		:param str key: key of the results the entries refer to.
+
+		:return: the entries, in the order they were appended.
+		:rtype: list
+		'''
+		entries = []
+		if not os.path.exists(self._path):
+			return entries
+		with self._lock, open(self._path, 'r') as f:
+			for line in f:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					continue
+				if entry.get('stage') == stage and entry.get('key') == key:
+					entries.append(entry)
+		return entries
+
+	def append(self, entry):
+		'''
+		Append an entry and flush it to disk.
+
+		:param dict entry: the entry, including its 'stage' and 'key'.
+		'''
+		line = json.dumps(entry) + '\n'
+		with self._lock, open(self._path, 'a') as f:
+			f.write(line)
+			f.flush()
+			os.fsync(f.fileno())
+
+	def drop(self, stage):
+		'''
+		Drop all entries of a stage (e.g. when its results are recomputed).
+
+		:param str stage: stage of the entries to drop.
+		'''
+		if not os.path.exists(self._path):
+			return
+		with self._lock:
+			with open(self._path, 'r') as f:
+				lines = f.readlines()
+			kept = []
+			for line in lines:
+				try:
+					if json.loads(line).get('stage') == stage:
+						continue
+				except ValueError:
+					continue
+				kept.append(line)
+			tmp = self._path + '.tmp'
+			with open(tmp, 'w') as f:
+				f.writelines(kept)
+			os.replace(tmp, self._path)
+
+	def remove(self):
+		'''Delete the log.'''
+		with self._lock:
+			if os.path.exists(self._path):
+				os.remove(self._path)
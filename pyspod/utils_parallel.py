@@ -0,0 +1,204 @@
+"""Module implementing utils for parallel computations."""
+
+# import standard python packages
+import os
+import shutil
+import warnings
+import contextlib
+import collections
+import psutil
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+
+BYTE_TO_GB = 9.3132257461548e-10
+
+
+
+# state inherited by (forked) worker processes
+_worker = dict()
+
+
+
+def fork_available():
+	'''
+	Check whether worker processes can be started with `fork`, that
+	lets them inherit the SPOD object (including its data handler)
+	without pickling it.
+	'''
+	return 'fork' in mp.get_all_start_methods()
+
+
+
+def blas_threads_limit(n_workers):
+	'''
+	Limit the threads used by BLAS/LAPACK so that `n_workers` concurrent
+	workers do not oversubscribe the available cores. Requires the optional
+	package `threadpoolctl`; without it no limit is applied.
+
+	:param int n_workers: number of concurrent workers.
+
+	:return: context manager applying the limit.
+	'''
+	try:
+		from threadpoolctl import threadpool_limits
+	except ImportError:
+		warnings.warn(
+			'Package `threadpoolctl` not found: BLAS threads are not '
+			'limited and workers may oversubscribe the cores.')
+		return contextlib.nullcontext()
+	n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+	return threadpool_limits(limits=n_threads, user_api='blas')
+
+
+
+def create_shared_array(shape, dtype):
+	'''
+	Allocate a numpy array in shared memory.
+
+	:param tuple shape: shape of the array.
+	:param dtype: data type of the array.
+
+	:return: the array and the underlying shared memory block
+		(to be closed and unlinked by the caller).
+	:rtype: numpy.ndarray, multiprocessing.shared_memory.SharedMemory
+	'''
+	size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+	shm = shared_memory.SharedMemory(create=True, size=size)
+	array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+	return array, shm
+
+
+
+def release_shared_array(shm):
+	'''Close and unlink a shared memory block.'''
+	try:
+		shm.close()
+	except BufferError:
+		# views still alive, memory is released when they are collected
+		pass
+	try:
+		shm.unlink()
+	except FileNotFoundError:
+		pass
+
+
+
+def plan_slots(gb_block, n_workers, n_blocks_batch, memory_gb):
+	'''
+	Plan the shared memory buffer of `imap_blocks` within a memory budget:
+	at most `n_workers + 1` slots of `n_blocks_batch` blocks, fewer slots
+	if they do not fit, and fewer blocks per batch if two slots (one
+	being consumed, one being computed) do not fit either.
+
+	:param float gb_block: size of one FFT block, in GB.
+	:param int n_workers: number of worker processes.
+	:param int n_blocks_batch: blocks per batch requested.
+	:param float memory_gb: memory budget of the buffer, in GB.
+
+	:return: number of slots and blocks per batch; 0 slots if two slots
+		of one block do not fit in the budget.
+	:rtype: int, int
+	'''
+	n_slots = min(n_workers + 1, int(memory_gb / (gb_block * n_blocks_batch)))
+	if n_slots >= 2:
+		return n_slots, n_blocks_batch
+	n_blocks_batch = int(memory_gb / (2 * gb_block))
+	if n_blocks_batch < 1:
+		return 0, 0
+	return 2, n_blocks_batch
+
+
+
+def shared_memory_gb():
+	'''
+	Get the default memory budget of shared buffers: a quarter of the
+	available RAM, bounded by the free space of /dev/shm where present.
+
+	:return: memory budget, in GB.
+	:rtype: float
+	'''
+	gb = 0.25 * psutil.virtual_memory()[1] * BYTE_TO_GB
+	if os.path.isdir('/dev/shm'):
+		gb = min(gb, shutil.disk_usage('/dev/shm')[2] * BYTE_TO_GB)
+	return gb
+
+
+
+def _compute_blocks_worker(args):
+	iBlk_start, iBlk_end, slot = args
+	spod = _worker['spod']
+	n_read, n_reused = spod._n_snapshots_read, spod._n_snapshots_reused
+	if spod._x_sum is not None:
+		spod._x_sum[:] = 0
+	Q_blks_hat, offsets = spod.compute_blocks_batch(iBlk_start, iBlk_end)
+	_worker['slots'][slot,:,:,0:iBlk_end-iBlk_start] = Q_blks_hat
+	return offsets, spod._n_snapshots_read - n_read, \
+		spod._n_snapshots_reused - n_reused, spod._x_sum
+
+
+
+def imap_blocks(spod, batches, n_workers, n_slots=None, dtype='complex_'):
+	'''
+	Compute batches of FFT blocks on a pool of `n_workers` processes.
+	Each worker reads, windows and transforms a batch of blocks through
+	`spod.compute_blocks_batch`, and writes the result into one of
+	`n_slots` slots of a shared memory buffer (see `plan_slots`; by
+	default `n_workers + 1`). Batches are yielded
+	in order, as views into the shared buffer that are valid until the
+	next batch is requested.
+
+	Workers are forked, and inherit a copy of the data handler in its
+	present state, but only the calling thread: locks held and threads
+	started by the handler (e.g. a pool of reading threads) are not
+	usable in the workers, and may deadlock them. Handlers holding such
+	state should create it per call, or set the attribute `fork_safe` to
+	False, in which case blocks are computed serially.
+
+	:param SPOD_base spod: the SPOD object computing the blocks.
+	:param list batches: list of (iBlk_start, iBlk_end) tuples.
+	:param int n_workers: number of worker processes.
+	:param int n_slots: number of slots of the shared buffer (at least 2).
+
+	:return: generator of (iBlk_start, iBlk_end, Q_blks_hat, offsets).
+	'''
+	if n_slots is None:
+		n_slots = n_workers + 1
+	n_blocks_batch = max([iBlk_end - iBlk_start for iBlk_start, iBlk_end in batches])
+	slots_shape = (n_slots, spod.n_freq, spod.n_points, n_blocks_batch)
+	slots, shm = create_shared_array(slots_shape, dtype)
+	# the SPOD object and the shared buffer are inherited by forked workers
+	_worker['spod'] = spod
+	_worker['slots'] = slots
+	try:
+		ctx = mp.get_context('fork')
+		with ctx.Pool(n_workers) as pool:
+			pending = collections.deque()
+			batches = iter(batches)
+			free_slots = list(range(n_slots))
+			while True:
+				# keep all slots busy
+				while free_slots:
+					batch = next(batches, None)
+					if batch is None:
+						break
+					slot = free_slots.pop()
+					pending.append((batch, slot, pool.apply_async(
+						_compute_blocks_worker, ((batch[0], batch[1], slot),))))
+				if not pending:
+					break
+				(iBlk_start, iBlk_end), slot, result = pending.popleft()
+				offsets, n_read, n_reused, x_sum = result.get()
+				spod._n_snapshots_read += n_read
+				spod._n_snapshots_reused += n_reused
+				if x_sum is not None:
+					spod._x_sum += x_sum
+				yield iBlk_start, iBlk_end, \
+					slots[slot,:,:,0:iBlk_end-iBlk_start], offsets
+				free_slots.append(slot)
+	finally:
+		_worker.pop('spod', None)
+		_worker.pop('slots', None)
+		del slots
+		release_shared_array(shm)
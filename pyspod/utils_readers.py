@@ -0,0 +1,593 @@
+"""Module implementing data handlers (readers) for common data formats."""
+
+# import standard python packages
+import os
+import re
+import glob
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import h5py
+import numpy as np
+import xarray as xr
+
+
+BYTE_TO_GB = 9.3132257461548e-10
+
+
+
+class XarrayReader(object):
+	'''
+	Data handler reading snapshots lazily from netCDF (or any format readable
+	by xarray), to be passed as `data_handler` to the SPOD constructors.
+	The dataset is opened once and kept open; snapshots are read as
+	contiguous time slices, extended to the chunks of the file along time
+	(unless a chunk exceeds `max_chunk_gb`, e.g. whole-record or coprime
+	time chunks, in which case exact slices are read), and the last slice
+	read is cached so that consecutive (and overlapping) blocks do not
+	read the same chunks twice. Variables are stacked into
+	the (t, x_1, ..., x_n, n_variables) layout expected by PySPOD.
+
+	Example: ``SPOD_low_ram(data='data.nc', params=params,
+	data_handler=XarrayReader(dtype='float32'), variables=['p'])``.
+
+	:param data: path of the file, or an open `xarray.Dataset`. If None,
+		the `data` passed to the handler is opened at the first read.
+	:param str time_dim: name of the time dimension. Default is 'time'.
+	:param dtype: type the snapshots are cast to (e.g. 'float32'), or None
+		to keep the type of the file. Default is None.
+	:param dict open_kwargs: keyword arguments of `xarray.open_dataset`.
+	:param float max_chunk_gb: maximum size of the time chunks slices are
+		extended to, in GB. Default is 0.25.
+	'''
+
+	def __init__(self, data=None, time_dim='time', dtype=None, open_kwargs=None,
+		max_chunk_gb=0.25):
+		self._time_dim = time_dim
+		self._max_chunk_gb = max_chunk_gb
+		self._dtype = None if dtype is None else np.dtype(dtype)
+		self._open_kwargs = dict() if open_kwargs is None else open_kwargs
+		self._ds = None
+		self._path = None
+		self._bytes_read = 0
+		self._cache = None
+		if data is not None:
+			self._open(data)
+
+	@property
+	def path(self):
+		'''
+		Get the path of the file.
+
+		:return: path of the file (None if an open dataset was passed).
+		:rtype: str
+		'''
+		return self._path
+
+	@property
+	def dataset(self):
+		'''
+		Get the open dataset.
+
+		:return: the dataset.
+		:rtype: xarray.Dataset
+		'''
+		return self._ds
+
+	@property
+	def bytes_read(self):
+		'''
+		Get the number of bytes read from the dataset.
+
+		:return: number of bytes read.
+		:rtype: int
+		'''
+		return self._bytes_read
+
+	def _open(self, data):
+		if isinstance(data, xr.Dataset):
+			self._ds = data
+		else:
+			self._path = str(data)
+			self._ds = xr.open_dataset(self._path, **self._open_kwargs)
+		self._cache = None
+
+	def close(self):
+		'''Close the dataset.'''
+		if self._ds is not None and self._path is not None:
+			self._ds.close()
+		self._ds = None
+		self._cache = None
+
+	def chunk_size(self, variables):
+		'''
+		Get the number of snapshots per chunk of the file along time, i.e.
+		the least common multiple of the time chunks of `variables`, or 1
+		if the chunk of all variables exceeds `max_chunk_gb`.
+
+		:param list variables: names of the variables.
+
+		:return: snapshots per chunk (1 for contiguous variables).
+		:rtype: int
+		'''
+		chunk = 1
+		snapshot_bytes = 0
+		for var in variables:
+			da = self._ds[var]
+			snapshot_bytes += da.dtype.itemsize * da.size // da.sizes[self._time_dim]
+			chunks = da.encoding.get('chunksizes', None) \
+				or da.encoding.get('chunks', None)
+			if chunks:
+				chunk = np.lcm(chunk, int(chunks[da.dims.index(self._time_dim)]))
+		if chunk * snapshot_bytes * BYTE_TO_GB > self._max_chunk_gb:
+			return 1
+		return int(chunk)
+
+	def _read(self, t_0, t_end, variables):
+		nt = self._ds.sizes[self._time_dim]
+		chunk = self.chunk_size(variables)
+		t_0_read = (t_0 // chunk) * chunk
+		t_end_read = min(nt, -(-t_end // chunk) * chunk)
+		X = None
+		for i, var in enumerate(variables):
+			da = self._ds[var].isel({self._time_dim: slice(t_0_read, t_end_read)})
+			da = da.transpose(self._time_dim, ...)
+			x = da.values
+			self._bytes_read += x.nbytes
+			if self._dtype is not None:
+				x = x.astype(self._dtype, copy=False)
+			if len(variables) == 1:
+				X = x[...,np.newaxis]
+			else:
+				if X is None:
+					X = np.empty(x.shape+(len(variables),), dtype=x.dtype)
+				X[...,i] = x
+		return t_0_read, t_end_read, X
+
+	def __call__(self, data, t_0, t_end, variables):
+		'''
+		Read snapshots `t_0` to `t_end` (excluded), or snapshot `t_0`
+		if `t_0` == `t_end` (data handler interface of PySPOD).
+
+		:return: snapshots [t_end-t_0, x_1, ..., x_n, n_variables].
+		:rtype: numpy.ndarray
+		'''
+		if self._ds is None:
+			self._open(data)
+		if t_0 > t_end:
+			raise ValueError('`t_0` cannot be greater than `t_end`.')
+		if t_0 >= self._ds.sizes[self._time_dim]:
+			raise ValueError('`t_0` cannot be greater or equal to time dimension.')
+		if t_0 == t_end:
+			t_end = t_0 + 1
+		variables = list(variables)
+
+		# read (only the snapshots not in the cache)
+		if self._cache is not None and self._cache[3] == variables \
+			and self._cache[0] <= t_0 < self._cache[1]:
+			c_0, c_end, X_cache, _ = self._cache
+			if t_end > c_end:
+				_, t_end_read, X = self._read(c_end, t_end, variables)
+				X = np.concatenate([X_cache[t_0-c_0:], X])
+				self._cache = (t_0, t_end_read, X, variables)
+		else:
+			c_0, c_end, X = self._read(t_0, t_end, variables)
+			self._cache = (c_0, c_end, X, variables)
+		c_0, _, X, _ = self._cache
+		return X[t_0-c_0:t_end-c_0]
+
+
+
+class MultiFileReader(object):
+	'''
+	Data handler reading snapshots from a time-ordered collection of
+	files (e.g. one netCDF file per month), concatenated along time.
+	The time index across the files is built once; requests spanning
+	several files are read from each of them through a small pool of
+	open files (each an `XarrayReader`, reading chunk-aligned time
+	slices), and assembled into one array. Files may be read by several
+	threads, but the netCDF4/HDF5 libraries hold a global lock during
+	reads, so that threads only overlap decompression and copies (e.g.
+	with the h5netcdf engine, or zarr stores) and reads are otherwise
+	serialized: by default files are read one at a time.
+
+	:param files: list of paths, or glob pattern, of the files (sorted
+		by name if a pattern is given).
+	:param str time_dim: name of the time dimension. Default is 'time'.
+	:param dtype: type the snapshots are cast to (e.g. 'float32'), or None
+		to keep the type of the files. Default is None.
+	:param int max_open: maximum number of files kept open. Default is 4.
+	:param int n_workers: number of threads reading files. Default is 1.
+	:param dict open_kwargs: keyword arguments of `xarray.open_dataset`.
+	'''
+
+	def __init__(self, files, time_dim='time', dtype=None, max_open=4,
+		n_workers=1, open_kwargs=None):
+		if isinstance(files, str):
+			files = sorted(glob.glob(files))
+		if len(files) == 0:
+			raise ValueError('No files to read.')
+		self._files = [str(f) for f in files]
+		self._time_dim = time_dim
+		self._dtype = dtype
+		self._max_open = max(1, int(max_open))
+		self._n_workers = max(1, int(n_workers))
+		self._open_kwargs = dict() if open_kwargs is None else open_kwargs
+		self._readers = collections.OrderedDict()
+		self._in_use = collections.Counter()
+		self._lock = threading.Lock()
+		self._bytes_read = 0
+
+		# time index: first snapshot of each file
+		n_snapshots = []
+		for f in self._files:
+			with xr.open_dataset(f, **self._open_kwargs) as ds:
+				n_snapshots.append(ds.sizes[self._time_dim])
+		self._t_start = np.concatenate([[0], np.cumsum(n_snapshots)])
+
+	@property
+	def files(self):
+		'''
+		Get the files read.
+
+		:return: paths of the files.
+		:rtype: list
+		'''
+		return self._files
+
+	@property
+	def n_snapshots(self):
+		'''
+		Get the number of snapshots in all files.
+
+		:return: number of snapshots.
+		:rtype: int
+		'''
+		return int(self._t_start[-1])
+
+	@property
+	def bytes_read(self):
+		'''
+		Get the number of bytes read from the files.
+
+		:return: number of bytes read.
+		:rtype: int
+		'''
+		with self._lock:
+			return self._bytes_read + \
+				sum([r.bytes_read for r in self._readers.values()])
+
+	def _acquire(self, iFile):
+		# get a reader of file `iFile` from the pool, closing the least
+		# recently used files (not being read) if too many are open
+		with self._lock:
+			self._in_use[iFile] += 1
+			if iFile in self._readers:
+				self._readers.move_to_end(iFile)
+				return self._readers[iFile]
+			reader = XarrayReader(self._files[iFile], time_dim=self._time_dim,
+				dtype=self._dtype, open_kwargs=self._open_kwargs)
+			self._readers[iFile] = reader
+			for iFile_open in list(self._readers.keys()):
+				if len(self._readers) <= self._max_open:
+					break
+				if self._in_use[iFile_open] == 0:
+					evicted = self._readers.pop(iFile_open)
+					self._bytes_read += evicted.bytes_read
+					evicted.close()
+			return reader
+
+	def _release(self, iFile):
+		with self._lock:
+			self._in_use[iFile] -= 1
+
+	def close(self):
+		'''Close all open files.'''
+		with self._lock:
+			for reader in self._readers.values():
+				self._bytes_read += reader.bytes_read
+				reader.close()
+			self._readers.clear()
+
+	def __call__(self, data, t_0, t_end, variables):
+		'''
+		Read snapshots `t_0` to `t_end` (excluded), or snapshot `t_0`
+		if `t_0` == `t_end` (data handler interface of PySPOD).
+
+		:return: snapshots [t_end-t_0, x_1, ..., x_n, n_variables].
+		:rtype: numpy.ndarray
+		'''
+		if t_0 > t_end:
+			raise ValueError('`t_0` cannot be greater than `t_end`.')
+		if t_0 >= self.n_snapshots:
+			raise ValueError('`t_0` cannot be greater or equal to time dimension.')
+		if t_0 == t_end:
+			t_end = t_0 + 1
+		t_end = min(t_end, self.n_snapshots)
+
+		# portions of the files to read
+		iFile_0 = np.searchsorted(self._t_start, t_0, side='right') - 1
+		iFile_end = np.searchsorted(self._t_start, t_end, side='left')
+		parts = []
+		for iFile in range(iFile_0, iFile_end):
+			t_0_file = max(t_0, self._t_start[iFile])
+			t_end_file = min(t_end, self._t_start[iFile+1])
+			parts.append((iFile, int(t_0_file), int(t_end_file)))
+
+		def read(part):
+			iFile, t_0_file, t_end_file = part
+			t_file = self._t_start[iFile]
+			try:
+				return self._acquire(iFile)(None,
+					t_0_file-t_file, t_end_file-t_file, variables)
+			finally:
+				self._release(iFile)
+
+		# single file: snapshots returned as they are read
+		if len(parts) == 1:
+			return read(parts[0])
+
+		# several files: read (in parallel if required) and assembled in one array
+		X = None
+		n_workers = min(self._n_workers, len(parts), self._max_open)
+		if n_workers > 1:
+			with ThreadPoolExecutor(max_workers=n_workers) as pool:
+				X_files = list(pool.map(read, parts))
+		else:
+			X_files = [read(part) for part in parts]
+		for (_, t_0_file, t_end_file), X_file in zip(parts, X_files):
+			if X is None:
+				X = np.empty((t_end-t_0,)+X_file.shape[1:], dtype=X_file.dtype)
+			X[t_0_file-t_0:t_end_file-t_0] = X_file
+		return X
+
+
+
+def _natural_key(path):
+	# sort key ordering numbers by value (e.g. snap_2 before snap_10)
+	return [int(s) if s.isdigit() else s for s in re.split(r'(\d+)', path)]
+
+
+
+class SnapshotDirectoryReader(object):
+	'''
+	Data handler reading snapshots from a directory with one file per
+	snapshot (e.g. the output of CFD simulations), in .npy or HDF5 format.
+	Files are sorted by name (numbers by value). The snapshots requested
+	are read concurrently by a pool of threads, each file being loaded
+	directly into its slot of the array returned. The pool is created
+	for each request, so that no thread is alive between reads (and
+	the reader can be used by forked workers, see `n_workers`).
+
+	A .npy file holds one snapshot [x_1, ..., x_n] (one variable) or
+	[x_1, ..., x_n, n_variables]; an HDF5 file holds one dataset
+	[x_1, ..., x_n] per variable, named as the variable.
+
+	:param str path: directory of the files.
+	:param str pattern: glob pattern of the files in the directory.
+		Default is '*.npy'.
+	:param dtype: type of the snapshots returned. Default is 'float64'.
+	:param int n_workers: number of threads reading files. Default is 8.
+	'''
+
+	def __init__(self, path, pattern='*.npy', dtype='float64', n_workers=8):
+		self._files = sorted(glob.glob(os.path.join(path, pattern)), key=_natural_key)
+		if len(self._files) == 0:
+			raise ValueError('No files matching `{}` in: {}'.format(pattern, path))
+		self._dtype = np.dtype(dtype)
+		self._n_workers = max(1, int(n_workers))
+		self._shapes = dict()
+		self._bytes_read = 0
+		self._lock = threading.Lock()
+
+	@property
+	def files(self):
+		'''
+		Get the files read, in order of time.
+
+		:return: paths of the files.
+		:rtype: list
+		'''
+		return self._files
+
+	@property
+	def n_snapshots(self):
+		'''
+		Get the number of snapshots.
+
+		:return: number of snapshots.
+		:rtype: int
+		'''
+		return len(self._files)
+
+	@property
+	def bytes_read(self):
+		'''
+		Get the number of bytes read from the files.
+
+		:return: number of bytes read.
+		:rtype: int
+		'''
+		return self._bytes_read
+
+	def close(self):
+		'''Release the reader (threads are stopped after each read).'''
+		pass
+
+	def _load(self, file, X, variables):
+		# load snapshot from `file` into X [x_1, ..., x_n, n_variables]
+		if file.endswith('.npy'):
+			x = np.load(file, mmap_mode='r')
+			X[...] = x.reshape(X.shape)
+			n_bytes = x.nbytes
+		else:
+			n_bytes = 0
+			with h5py.File(file, 'r') as f:
+				for i, var in enumerate(variables):
+					X[...,i] = f[var][()]
+					n_bytes += f[var].nbytes
+		with self._lock:
+			self._bytes_read += n_bytes
+
+	def _shape(self, variables):
+		# shape of one snapshot [x_1, ..., x_n, n_variables]
+		key = tuple(variables)
+		if key not in self._shapes:
+			file = self._files[0]
+			if file.endswith('.npy'):
+				shape = np.load(file, mmap_mode='r').shape
+				if len(variables) == 1 and (len(shape) == 0 or shape[-1] != 1):
+					shape = shape + (1,)
+			else:
+				with h5py.File(file, 'r') as f:
+					shape = f[variables[0]].shape + (len(variables),)
+			self._shapes[key] = shape
+		return self._shapes[key]
+
+	def __call__(self, data, t_0, t_end, variables):
+		'''
+		Read snapshots `t_0` to `t_end` (excluded), or snapshot `t_0`
+		if `t_0` == `t_end` (data handler interface of PySPOD).
+
+		:return: snapshots [t_end-t_0, x_1, ..., x_n, n_variables].
+		:rtype: numpy.ndarray
+		'''
+		if t_0 > t_end:
+			raise ValueError('`t_0` cannot be greater than `t_end`.')
+		if t_0 >= self.n_snapshots:
+			raise ValueError('`t_0` cannot be greater or equal to time dimension.')
+		if t_0 == t_end:
+			t_end = t_0 + 1
+		t_end = min(t_end, self.n_snapshots)
+		variables = list(variables)
+		X = np.empty((t_end-t_0,)+self._shape(variables), dtype=self._dtype)
+		n_workers = min(self._n_workers, t_end-t_0)
+		with ThreadPoolExecutor(max_workers=n_workers) as pool:
+			futures = [pool.submit(self._load, self._files[t], X[t-t_0], variables)
+				for t in range(t_0, t_end)]
+			for future in futures:
+				future.result()
+		return X
+
+
+
+class MemmapReader(object):
+	'''
+	Data handler memory-mapping a raw binary or .npy file holding the
+	snapshots [t, x_1, ..., x_n] (one variable) or [t, x_1, ..., x_n,
+	n_variables], optionally reading only a spatial subset (sub-box and/or
+	stride), so that only the region of interest is paged in from disk.
+	Without subset, snapshots are returned as views of the mapped file.
+	Points of the snapshots can also be read alone (`read_points`), e.g.
+	by `SPOD_tiled` reading one tile of points at a time.
+
+	Example: ``MemmapReader('data.bin', shape=(nt, nx, ny, nz),
+	dtype='float32', subset=(slice(0, 64), slice(0, 64), slice(None, None, 2)))``.
+
+	:param str path: path of the file.
+	:param tuple shape: shape of the data in a raw binary file (ignored
+		for .npy files).
+	:param dtype: type of the data in a raw binary file (ignored for .npy
+		files). Default is 'float64'.
+	:param int offset: offset in bytes of the data in a raw binary file.
+		Default is 0.
+	:param tuple subset: slices selecting the spatial region to read, one
+		per spatial dimension (e.g. ``(slice(0, 100), slice(None, None, 2))``),
+		or None to read the whole domain. Default is None.
+	'''
+
+	def __init__(self, path, shape=None, dtype='float64', offset=0, subset=None):
+		if str(path).endswith('.npy'):
+			self._data = np.load(path, mmap_mode='r')
+		else:
+			if shape is None:
+				raise ValueError('`shape` is required for raw binary files.')
+			self._data = np.memmap(path, dtype=dtype, mode='r',
+				offset=offset, shape=tuple(shape))
+		self._subset = None if subset is None else tuple(subset)
+		if self._subset is not None and len(self._subset) > self._data.ndim - 1:
+			raise ValueError('`subset` has more dimensions than the data.')
+
+	@property
+	def data(self):
+		'''
+		Get the mapped data.
+
+		:return: the memory-mapped data.
+		:rtype: numpy.memmap
+		'''
+		return self._data
+
+	@property
+	def n_snapshots(self):
+		'''
+		Get the number of snapshots.
+
+		:return: number of snapshots.
+		:rtype: int
+		'''
+		return self._data.shape[0]
+
+	@property
+	def shape(self):
+		'''
+		Get the shape of the snapshots read (all snapshots).
+
+		:return: shape [t, x_1, ..., x_n(, n_variables)] of the subset read.
+		:rtype: tuple
+		'''
+		return self._select(slice(None)).shape
+
+	def _select(self, times):
+		if self._subset is None:
+			return self._data[times]
+		return self._data[(times,)+self._subset]
+
+	def read_points(self, data, t_0, t_end, variables, points):
+		'''
+		Read snapshots `t_0` to `t_end` (excluded) at the points `points`
+		of the flattened snapshots [x_1*...*x_n*n_variables] of the
+		subset, paging in only those points.
+
+		:param points: slice or indices of the points.
+
+		:return: points of the snapshots [t_end-t_0, n_points].
+		:rtype: numpy.ndarray
+		'''
+		X = self._data[t_0:t_end]
+		X = np.reshape(X, (t_end-t_0, -1))
+		if self._subset is None:
+			return X[:,points]
+		# map the points of the subset to the points of the flattened
+		# snapshots, for the requested points only
+		shape = self._data.shape[1:]
+		subset = self._subset + (slice(None),) * (len(shape) - len(self._subset))
+		ranges = [range(*s.indices(n)) for s, n in zip(subset, shape)]
+		shape_subset = tuple(len(r) for r in ranges)
+		if isinstance(points, slice):
+			points = np.arange(*points.indices(int(np.prod(shape_subset))))
+		idx = np.unravel_index(points, shape_subset)
+		idx = tuple(r.start + r.step * i for r, i in zip(ranges, idx))
+		return X[:,np.ravel_multi_index(idx, shape)]
+
+	def __call__(self, data, t_0, t_end, variables):
+		'''
+		Read snapshots `t_0` to `t_end` (excluded), or snapshot `t_0`
+		if `t_0` == `t_end` (data handler interface of PySPOD).
+
+		:return: snapshots [t_end-t_0, x_1, ..., x_n, n_variables].
+		:rtype: numpy.ndarray
+		'''
+		if t_0 > t_end:
+			raise ValueError('`t_0` cannot be greater than `t_end`.')
+		if t_0 >= self.n_snapshots:
+			raise ValueError('`t_0` cannot be greater or equal to time dimension.')
+		if t_0 == t_end:
+			t_end = t_0 + 1
+		X = self._select(slice(t_0, t_end))
+		if self._subset is not None:
+			# page in only the subset, as one contiguous array
+			X = np.ascontiguousarray(X)
+		if len(variables) == 1 and X.shape[-1] != 1:
+			X = X[...,np.newaxis]
+		return X
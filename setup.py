@@ -14,7 +14,7 @@ VERSION = pyspod.__version__
 KEYWORDS='spectral-proper-orthogonal-decomposition spod'
 REQUIRED = [
 	"numpy",
-	"scipy",
+	"scipy>=1.5",
 	"matplotlib",
 	"xarray",
 	"netcdf4",
@@ -30,6 +30,7 @@ REQUIRED = [
 ]
 EXTRAS = {
 	'docs': ['Sphinx==3.2.1', 'sphinx_rtd_theme'],
+	'parallel': ['threadpoolctl'],
 }
 DESCR = (
 	"PySPOD is a Python package that implements the Spectral Proper Orthogonal"
@@ -2,6 +2,7 @@ import os
 import sys
 import shutil
 import subprocess
+import h5py
 import numpy as np
 
 # Current, parent and file paths
@@ -15,7 +16,11 @@ sys.path.append(os.path.join(CFD,"../pyspod"))
 from pyspod.spod_low_storage import SPOD_low_storage
 from pyspod.spod_low_ram     import SPOD_low_ram
 from pyspod.spod_streaming   import SPOD_streaming
+from pyspod.spod_tiled       import SPOD_tiled
 import utils_io
+from pyspod.utils_readers import SnapshotDirectoryReader, MemmapReader
+import pyspod.utils_async as utils_async
+import pyspod.utils_parallel as utils_parallel
 
 # Let's create some 2D syntetic data
 # and store them into a variable called p
@@ -135,8 +140,874 @@ def test_basic_spod_low_ram_default():
 		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
 
 
+def test_basic_compute_blocks_batch():
+	# Batched real-input FFT must match the complex FFT of each block
+	params_batch = params.copy()
+	params_batch['n_blocks_batch'] = 4
+	spod = SPOD_low_storage(p, params=params_batch, data_handler=False, variables=['p'])
+	Q_hat, offsets = spod.compute_blocks_batch(0, 4)
+	assert(Q_hat.shape == (spod.n_freq, spod.nx * spod.nv, 4))
+	for i in range(0,4):
+		Q_blk_hat, offset = spod.compute_blocks(i)
+		assert(offset == offsets[i])
+		assert(np.allclose(Q_hat[:,:,i], Q_blk_hat, atol=1e-12))
+
+		# reference: complex FFT of the full block, one-sided
+		Q_blk = p[offset:offset+spod._n_DFT].reshape(spod._n_DFT, -1)
+		Q_blk = Q_blk - np.mean(Q_blk, axis=0)
+		Q_ref = np.fft.fft(Q_blk * spod._window, axis=0) * spod._winWeight / spod._n_DFT
+		Q_ref = Q_ref[0:spod.n_freq]
+		Q_ref[1:-1] = 2 * Q_ref[1:-1]
+		assert(np.allclose(Q_hat[:,:,i], Q_ref, atol=1e-12))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_compute_blocks_integer():
+	# Integer snapshots with no mean subtracted are windowed as float
+	params_int = params.copy()
+	params_int['mean_type'] = 'zero'
+	p_int = np.round(100 * p).astype(int)
+	spod = SPOD_low_storage(p_int, params=params_int, data_handler=False, variables=['p'])
+	Q_blk_hat, offset = spod.compute_blocks(0)
+	spod_ref = SPOD_low_storage(p_int.astype(float), params=params_int, data_handler=False, variables=['p'])
+	Q_blk_ref, _ = spod_ref.compute_blocks(0)
+	assert(np.allclose(Q_blk_hat, Q_blk_ref, atol=1e-12))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_compute_blocks_parallel():
+	# Blocks computed by a pool of processes must match the serial ones
+	params_par = params.copy()
+	params_par['n_blocks_batch'] = 3
+	spod = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+	Q_hat_ser = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat_ser)
+	params_par['n_workers'] = 2
+	spod = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+	Q_hat_par = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat_par)
+	assert(np.array_equal(Q_hat_ser, Q_hat_par))
+
+	# shared buffer within its memory budget: fewer blocks per
+	# batch, or serial blocks if two blocks do not fit
+	gb_block = spod.n_freq * spod.nx * spod.nv * 16 * 9.3132257461548e-10
+	assert(utils_parallel.plan_slots(gb_block, 8, 3, 100 * gb_block) == (9, 3))
+	assert(utils_parallel.plan_slots(gb_block, 8, 3, 7 * gb_block) == (2, 3))
+	assert(utils_parallel.plan_slots(gb_block, 8, 3, 2.5 * gb_block) == (2, 1))
+	assert(utils_parallel.plan_slots(gb_block, 8, 3, 1.5 * gb_block) == (0, 0))
+	for gb_workers in [2.5 * gb_block, 1.5 * gb_block]:
+		params_par['workers_memory_gb'] = gb_workers
+		spod = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+		Q_hat_par = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+		spod.compute_all_blocks(Q_hat=Q_hat_par)
+		assert(np.array_equal(Q_hat_ser, Q_hat_par))
+	del params_par['workers_memory_gb']
+
+	# full fit on the low_ram algorithm
+	spod_ram = SPOD_low_ram(p, params=params_par, data_handler=False, variables=['p'])
+	spod_ram.fit()
+	T_approx = 10 # approximate period = 10 days (in days)
+	freq_found, freq_idx = spod_ram.find_nearest_freq(freq_required=1/T_approx, freq=spod_ram.freq)
+	modes_at_freq = spod_ram.get_modes_at_freq(freq_idx=freq_idx)
+	tol = 1e-10
+	assert((np.max(np.abs(modes_at_freq))   < 0.02991911832816271   +tol) & \
+		   (np.max(np.abs(modes_at_freq))   > 0.02991911832816271   -tol))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_compute_blocks_threaded_handler():
+	# A handler holding a pool of threads is not fork-safe: with
+	# n_workers > 1 blocks are computed serially instead of deadlocking
+	from concurrent.futures import ThreadPoolExecutor
+	class ThreadedHandler(object):
+		fork_safe = False
+		def __init__(self):
+			self._pool = ThreadPoolExecutor(max_workers=2)
+		def __call__(self, data, t_0, t_end, variables):
+			if t_0 == t_end:
+				t_end = t_0 + 1
+			return self._pool.submit(lambda: data[t_0:t_end,...,np.newaxis]).result()
+	handler = ThreadedHandler()
+	params_par = params.copy()
+	params_par['mean_type'] = 'longtime'
+	params_par['n_workers'] = 2
+	spod = SPOD_low_storage(p, params=params_par, data_handler=handler, variables=['p'])
+	assert(spod._n_workers == 1)
+	Q_hat_thr = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat_thr)
+	handler._pool.shutdown()
+	params_par['n_workers'] = 1
+	spod = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+	Q_hat_ser = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat_ser)
+	assert(np.allclose(Q_hat_thr, Q_hat_ser, atol=1e-12))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_snapshots_buffer():
+	# Overlapping blocks are built from a sliding buffer of snapshots
+	params_ovlp = params.copy()
+	params_ovlp['overlap'] = 50
+	spod = SPOD_low_storage(p, params=params_ovlp, data_handler=False, variables=['p'])
+	Q_hat = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat)
+	assert(spod.n_snapshots_read == t.shape[0])
+	assert(spod.n_snapshots_reused == (spod._n_blocks - 1) * spod._n_overlap)
+	for iBlk in [0, spod._n_blocks-1]:
+		offset = iBlk * (spod._n_DFT - spod._n_overlap)
+		Q_blk = p[offset:offset+spod._n_DFT].reshape(spod._n_DFT, -1)
+		Q_blk = Q_blk - np.mean(Q_blk, axis=0)
+		assert(np.array_equal(spod._fft_blocks(Q_blk), Q_hat[:,:,iBlk]))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_fused_mean():
+	# Longtime mean computed in the same pass as the blocks
+	params_mean = params.copy()
+	params_mean['mean_type'] = 'longtime'
+	params_mean['overlap'  ] = 50
+	spod = SPOD_low_storage(p, params=params_mean, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(spod.n_snapshots_read == 2 * t.shape[0])
+	params_mean['fuse_mean'] = True
+	spod_fused = SPOD_low_storage(p, params=params_mean, data_handler=False, variables=['p'])
+	spod_fused.fit()
+	assert(spod_fused.n_snapshots_read == t.shape[0])
+	assert(np.allclose(spod_fused._x_mean, np.mean(p, axis=0).ravel(), atol=1e-12))
+	assert(np.allclose(spod_fused.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+	spod_ram = SPOD_low_ram(p, params=params_mean, data_handler=False, variables=['p'])
+	spod_ram.fit()
+	assert(np.allclose(spod_ram.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+
+	# snapshots after the last block must enter the mean
+	params_mean['overlap'    ] = 0
+	params_mean['n_snapshots'] = 950
+	spod_fused = SPOD_low_storage(p[:950], params=params_mean, data_handler=False, variables=['p'])
+	spod_fused.fit()
+	assert(spod_fused.n_snapshots_read == 950)
+	assert(np.allclose(spod_fused._x_mean, np.mean(p[:950], axis=0).ravel(), atol=1e-12))
+	params_mean['fuse_mean'] = False
+	spod = SPOD_low_storage(p[:950], params=params_mean, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.allclose(spod_fused.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_eig_solvers():
+	# Hermitian solvers must match the general eigensolver
+	params_eig = params.copy()
+	results = dict()
+	for eig_solver in ['eig', 'eigh', 'eigh_subset']:
+		params_eig['eig_solver'] = eig_solver
+		spod = SPOD_low_storage(p, params=params_eig, data_handler=False, variables=['p'])
+		spod.fit()
+		freq_found, freq_idx = spod.find_nearest_freq(freq_required=1/10, freq=spod.freq)
+		results[eig_solver] = (spod.eigs, np.abs(spod.get_modes_at_freq(freq_idx=freq_idx)))
+	assert(results['eig'        ][0].shape == (spod.n_freq, spod._n_blocks))
+	assert(results['eigh_subset'][0].shape == (spod.n_freq, params['n_modes_save']))
+	spod = SPOD_low_storage(p, params=params, data_handler=False, variables=['p'])
+	assert(spod._eig_solver == 'eigh')
+	assert(spod._eigs_c.shape[1] == spod._n_blocks)
+	for eig_solver in ['eigh', 'eigh_subset']:
+		eigs, modes = results[eig_solver]
+		assert(np.allclose(eigs[:,0:3], results['eig'][0][:,0:3], rtol=1e-8, atol=1e-10))
+		assert(np.allclose(modes[...,0], results['eig'][1][...,0], atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_eig_batched():
+	# Eigendecomposition batched across frequencies (low_storage)
+	params_eig = params.copy()
+	params_eig['n_freq_batch'] = 1
+	spod = SPOD_low_storage(p, params=params_eig, data_handler=False, variables=['p'])
+	spod.fit()
+	params_eig['n_freq_batch'] = 16
+	spod_batch = SPOD_low_storage(p, params=params_eig, data_handler=False, variables=['p'])
+	spod_batch.fit()
+	assert(np.allclose(spod_batch.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+	for freq_idx in [0, 10, spod.n_freq-1]:
+		modes = np.abs(spod.get_modes_at_freq(freq_idx=freq_idx))
+		modes_batch = np.abs(spod_batch.get_modes_at_freq(freq_idx=freq_idx))
+		assert(np.allclose(modes_batch[...,0], modes[...,0], atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_freq_parallel():
+	# Frequencies computed by a pool of threads
+	params_par = params.copy()
+	spod = SPOD_low_ram(p, params=params_par, data_handler=False, variables=['p'])
+	spod.fit()
+	for n_freq_batch in [1, 4]:
+		params_par['n_freq_workers'] = 3
+		params_par['n_freq_batch'  ] = n_freq_batch
+		spod_par = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+		spod_par.fit()
+		assert(np.allclose(spod_par.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+		assert(sorted(spod_par.modes.keys()) == list(range(0, spod.n_freq)))
+	spod_par = SPOD_low_ram(p, params=params_par, data_handler=False, variables=['p'])
+	spod_par.fit()
+	assert(np.allclose(spod_par.eigs, spod.eigs, rtol=1e-8, atol=1e-10))
+	modes = np.abs(spod.get_modes_at_freq(freq_idx=10))
+	modes_par = np.abs(spod_par.get_modes_at_freq(freq_idx=10))
+	assert(np.allclose(modes_par[...,0], modes[...,0], atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+def test_basic_blocks_store():
+	# FFT blocks saved in a single (compressed) HDF5 store and reused
+	params_store = params.copy()
+	params_store['savefft'            ] = True
+	params_store['savefft_compression'] = 'gzip'
+	spod_ls = SPOD_low_storage(p, params=params_store, data_handler=False, variables=['p'])
+	spod_ls.fit()
+	files = os.listdir(spod_ls._save_dir_blocks)
+	assert('fft_blocks.h5' in files)
+	assert(not any([f.startswith('fft_block') and f.endswith('.npy') for f in files]))
+	spod_ram = SPOD_low_ram(p, params=params_store, data_handler=False, variables=['p'])
+	assert(spod_ram._are_blocks_present())
+	spod_ram.fit()
+	assert(spod_ram.n_snapshots_read == 0)
+	assert(np.allclose(spod_ram.eigs, spod_ls.eigs, rtol=1e-8, atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_blocks_transpose():
+	# blocks staged block-major and transposed into frequency slabs
+	params_tr = params.copy()
+	params_tr['savefft'            ] = True
+	params_tr['reuse_blocks'       ] = False
+	params_tr['transpose_memory_gb'] = 2e-3
+	spod_ls = SPOD_low_storage(p, params=params_tr, data_handler=False, variables=['p'])
+	spod_ls.fit()
+	spod_ram = SPOD_low_ram(p, params=params_tr, data_handler=False, variables=['p'])
+	spod_ram.fit()
+	files = os.listdir(spod_ram._save_dir_blocks)
+	assert('fft_blocks_staging.h5' not in files)
+	with h5py.File(os.path.join(spod_ram._save_dir_blocks, 'fft_blocks.h5'), 'r') as f:
+		assert(f['Q_hat'].chunks == (1, spod_ram.nx * spod_ram.nv, spod_ram._n_blocks))
+	assert(np.allclose(spod_ram.eigs, spod_ls.eigs, rtol=1e-8, atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_prefetch():
+	# Snapshots of the next blocks read ahead on a background thread
+	params_pf = params.copy()
+	params_pf['overlap'] = 50
+	spod = SPOD_low_storage(p, params=params_pf, data_handler=False, variables=['p'])
+	Q_hat = np.empty([spod.n_freq, spod.nx * spod.nv, spod._n_blocks], dtype='complex_')
+	spod.compute_all_blocks(Q_hat=Q_hat)
+	params_pf['prefetch_depth'] = 2
+	spod_pf = SPOD_low_storage(p, params=params_pf, data_handler=False, variables=['p'])
+	Q_hat_pf = np.empty_like(Q_hat)
+	spod_pf.compute_all_blocks(Q_hat=Q_hat_pf)
+	assert(np.array_equal(Q_hat, Q_hat_pf))
+	assert(spod_pf.n_snapshots_read == spod.n_snapshots_read)
+	assert(spod_pf.n_snapshots_reused == spod.n_snapshots_reused)
+	assert(spod_pf._prefetcher is None)
+
+	# streaming reads the next snapshots ahead
+	spod_st = SPOD_streaming(p, params=params, data_handler=False, variables=['p'])
+	spod_st.fit()
+	params_st = params.copy()
+	params_st['prefetch_depth'] = 2
+	spod_st_pf = SPOD_streaming(p, params=params_st, data_handler=False, variables=['p'])
+	spod_st_pf.fit()
+	assert(np.allclose(spod_st.eigs, spod_st_pf.eigs))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_async_writer():
+	# Modes and FFT blocks written on a background thread
+	params_wr = params.copy()
+	params_wr['savefft'          ] = True
+	params_wr['reuse_blocks'     ] = False
+	params_wr['write_queue_depth'] = 2
+	spod = SPOD_low_ram(p, params=params, data_handler=False, variables=['p'])
+	spod.fit()
+	modes = [np.load(spod.modes[iFreq]) for iFreq in [0, spod.n_freq-1]]
+	shutil.rmtree(os.path.join(CWD,'results'))
+	spod_wr = SPOD_low_ram(p, params=params_wr, data_handler=False, variables=['p'])
+	assert(spod_wr._writer is None)
+	spod_wr.fit()
+	assert(spod_wr._writer is None)
+	assert(np.allclose(spod.eigs, spod_wr.eigs, rtol=1e-8, atol=1e-10))
+	for i, iFreq in enumerate([0, spod_wr.n_freq-1]):
+		assert(np.allclose(np.abs(modes[i]), np.abs(np.load(spod_wr.modes[iFreq]))))
+
+	shutil.rmtree(os.path.join(CWD,'results'))
+
+	# frequency threads share one writer, flushed when `fit` returns
+	params_wr['n_freq_workers'] = 4
+	AsyncWriter = utils_async.AsyncWriter
+	writers = []
+	def async_writer(depth):
+		writers.append(AsyncWriter(depth))
+		return writers[-1]
+	utils_async.AsyncWriter = async_writer
+	try:
+		spod_wr = SPOD_low_ram(p, params=params_wr, data_handler=False, variables=['p'])
+		spod_wr.fit()
+	finally:
+		utils_async.AsyncWriter = AsyncWriter
+	# one writer for the blocks, and one for the modes
+	assert(len(writers) == 2)
+	assert(np.allclose(spod.eigs, spod_wr.eigs, rtol=1e-8, atol=1e-10))
+	for iFreq in range(0, spod_wr.n_freq):
+		Psi = np.load(spod_wr.modes[iFreq])
+		assert(Psi.shape == p.shape[1:]+(1, spod_wr._n_modes_save))
+		assert(np.all(np.isfinite(Psi)))
+	for i, iFreq in enumerate([0, spod_wr.n_freq-1]):
+		assert(np.allclose(np.abs(modes[i]), np.abs(np.load(spod_wr.modes[iFreq]))))
+
+	# errors of background writes are raised in the caller
+	def fail():
+		raise OSError('disk full')
+	spod_wr.write(fail)
+	try:
+		spod_wr.wait_writes()
+		raised = False
+	except OSError:
+		raised = True
+	assert(raised)
+	assert(spod_wr._writer is None)
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_blocks_manifest():
+	# FFT blocks reused only if parameters and data match their manifest
+	params_mf = params.copy()
+	params_mf['savefft'      ] = True
+	params_mf['reuse_blocks' ] = True
+	params_mf['verify_blocks'] = True
+	spod = SPOD_low_storage(p, params=params_mf, data_handler=False, variables=['p'])
+	spod.fit()
+	files = os.listdir(spod._save_dir_blocks)
+	assert('fft_blocks_manifest.json' in files)
+	spod = SPOD_low_storage(p, params=params_mf, data_handler=False, variables=['p'])
+	assert(spod._are_blocks_present())
+
+	# corrupted blocks fail verification
+	with h5py.File(spod._blocks_store.path, 'a') as f:
+		f['Q_hat'][0,0,0] += 1
+	assert(not spod._are_blocks_present())
+	assert(not os.path.exists(spod._blocks_store.path))
+	spod.fit()
+
+	# different mean or data invalidate the blocks
+	params_mean = params_mf.copy()
+	params_mean['mean_type'] = 'longtime'
+	spod = SPOD_low_storage(p, params=params_mean, data_handler=False, variables=['p'])
+	assert(not spod._are_blocks_present())
+	spod.fit()
+	spod = SPOD_low_storage(2 * p, params=params_mean, data_handler=False, variables=['p'])
+	assert(not spod._are_blocks_present())
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_resume():
+	# Interrupted fits resume from the checkpoint log without recomputation
+	params_rs = params.copy()
+	params_rs['mean_type'     ] = 'longtime'
+	params_rs['fuse_mean'     ] = True
+	params_rs['n_blocks_batch'] = 2
+	params_rs['resume'        ] = True
+	params_ref = params_rs.copy()
+	params_ref['resume'] = False
+	params_ck = params_ref.copy()
+	params_ck['checkpoint'] = True
+	spod_ref = SPOD_low_ram(p, params=params_ref, data_handler=False, variables=['p'])
+	spod_ref.fit()
+	shutil.rmtree(os.path.join(CWD,'results'))
+
+	# interrupt the block stage after two batches (of a fit recording
+	# checkpoints, but not resuming)
+	spod = SPOD_low_ram(p, params=params_ck, data_handler=False, variables=['p'])
+	compute_blocks_batch = spod.compute_blocks_batch
+	calls = []
+	def interrupted_blocks(iBlk_start, iBlk_end, Q_hat=None):
+		if len(calls) == 2:
+			raise RuntimeError('interrupted')
+		calls.append(iBlk_start)
+		return compute_blocks_batch(iBlk_start, iBlk_end, Q_hat)
+	spod.compute_blocks_batch = interrupted_blocks
+	try:
+		spod.fit()
+	except RuntimeError:
+		pass
+
+	# interrupt the frequency stage after ten frequencies
+	spod = SPOD_low_ram(p, params=params_rs, data_handler=False, variables=['p'])
+	compute_standard_spod = spod.compute_standard_spod
+	freqs = []
+	n_freqs_max = 10
+	def interrupted_freqs(Q_hat_f, iFreq):
+		if len(freqs) == n_freqs_max:
+			raise RuntimeError('interrupted')
+		freqs.append(iFreq)
+		compute_standard_spod(Q_hat_f, iFreq)
+	spod.compute_standard_spod = interrupted_freqs
+	try:
+		spod.fit()
+	except RuntimeError:
+		pass
+	assert(spod.n_snapshots_read == t.shape[0] - 4 * spod._n_DFT)
+
+	# resume the remaining frequencies
+	spod = SPOD_low_ram(p, params=params_rs, data_handler=False, variables=['p'])
+	compute_standard_spod = spod.compute_standard_spod
+	freqs = []
+	n_freqs_max = None
+	spod.compute_standard_spod = interrupted_freqs
+	spod.fit()
+	assert(len(freqs) == spod.n_freq - 10)
+	assert(spod.n_snapshots_read == 0)
+	assert(np.allclose(spod.eigs, spod_ref.eigs, rtol=1e-8, atol=1e-10))
+	shutil.rmtree(os.path.join(CWD,'results'))
+
+	# longtime mean saved with the blocks, and not recomputed when resuming
+	params_rs['fuse_mean'] = False
+	params_ref['fuse_mean'] = False
+	params_ck['fuse_mean'] = False
+	spod_ref = SPOD_low_storage(p, params=params_ref, data_handler=False, variables=['p'])
+	spod_ref.fit()
+	assert(not os.path.exists(spod_ref._checkpoint.path))
+	shutil.rmtree(os.path.join(CWD,'results'))
+	spod = SPOD_low_storage(p, params=params_ck, data_handler=False, variables=['p'])
+	compute_blocks_batch = spod.compute_blocks_batch
+	calls = []
+	spod.compute_blocks_batch = interrupted_blocks
+	try:
+		spod.fit()
+	except RuntimeError:
+		pass
+	spod = SPOD_low_storage(p, params=params_rs, data_handler=False, variables=['p'])
+	assert(spod.n_snapshots_read == 0)
+	spod.fit()
+	assert(np.allclose(spod.eigs, spod_ref.eigs, rtol=1e-8, atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_zero_copy():
+	# Preloaded arrays and memmaps are used without copies
+	spod = SPOD_low_storage(p, params=params, data_handler=False, variables=['p'])
+	assert(np.shares_memory(spod._data, p))
+	X = spod._data_handler(spod._data, t_0=10, t_end=20, variables=['p'])
+	assert(np.shares_memory(X, p))
+	file_mmap = os.path.join(CWD, 'data_mmap.npy')
+	np.save(file_mmap, p)
+	p_mmap = np.load(file_mmap, mmap_mode='r')
+	spod_mmap = SPOD_low_storage(p_mmap, params=params, data_handler=False, variables=['p'])
+	assert(np.shares_memory(spod_mmap._data, p_mmap))
+	spod_mmap.fit()
+	spod.fit()
+	assert(np.allclose(spod.eigs, spod_mmap.eigs, rtol=1e-10, atol=1e-12))
+	del spod_mmap, p_mmap
+	os.remove(file_mmap)
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_snapshot_directory_reader():
+	# Snapshots read concurrently from one file per time step
+	path_snapshots = os.path.join(CWD,'results','snapshots')
+	os.makedirs(path_snapshots, exist_ok=True)
+	for ti in range(0, t.shape[0]):
+		np.save(os.path.join(path_snapshots,'snapshot_{}.npy'.format(ti)), p[ti])
+	path_snapshots_h5 = os.path.join(CWD,'results','snapshots_h5')
+	os.makedirs(path_snapshots_h5, exist_ok=True)
+	for ti in range(0, 150):
+		with h5py.File(os.path.join(path_snapshots_h5,'snapshot_{}.h5'.format(ti)), 'w') as f:
+			f['p'] = p[ti]
+	reader = SnapshotDirectoryReader(path_snapshots, n_workers=4)
+	assert(reader.n_snapshots == t.shape[0])
+	assert(np.array_equal(reader(None, 95, 105, variables)[...,0], p[95:105]))
+	reader_h5 = SnapshotDirectoryReader(path_snapshots_h5, pattern='*.h5')
+	assert(np.array_equal(reader_h5(None, 95, 105, variables)[...,0], p[95:105]))
+	spod_dir = SPOD_low_storage(path_snapshots, params=params, data_handler=reader, variables=['p'])
+	spod_dir.fit()
+	spod = SPOD_low_storage(p, params=params, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.allclose(spod_dir.eigs, spod.eigs, rtol=1e-10, atol=1e-12))
+
+	# reader used by forked workers, after reads in the parent
+	params_par = params.copy()
+	params_par['mean_type'] = 'longtime'
+	params_par['n_workers'] = 2
+	spod_par = SPOD_low_storage(path_snapshots, params=params_par, data_handler=reader, variables=['p'])
+	spod_par.fit()
+	params_par['n_workers'] = 1
+	spod = SPOD_low_storage(p, params=params_par, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.allclose(spod_par.eigs, spod.eigs, rtol=1e-10, atol=1e-12))
+	reader.close()
+	reader_h5.close()
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_memmap_reader():
+	# Raw binary and .npy files mapped, reading a spatial subset
+	os.makedirs(os.path.join(CWD,'results'), exist_ok=True)
+	file_raw = os.path.join(CWD,'results','data.bin')
+	file_npy = os.path.join(CWD,'results','data.npy')
+	p.tofile(file_raw)
+	np.save(file_npy, p)
+	subset = (slice(10, 40), slice(None, None, 2))
+	reader = MemmapReader(file_raw, shape=p.shape, dtype=p.dtype, subset=subset)
+	reader_npy = MemmapReader(file_npy)
+	assert(reader.shape == p[:,10:40,::2].shape)
+	assert(np.array_equal(reader(None, 5, 5, variables)[...,0], p[5:6,10:40,::2]))
+	assert(np.shares_memory(reader_npy(None, 5, 15, variables), reader_npy.data))
+	points = np.array([0, 7, 31, 200])
+	p_sub = p[5:8,10:40,::2].reshape(3, -1)
+	assert(np.array_equal(reader.read_points(None, 5, 8, variables, points), p_sub[:,points]))
+	assert(np.array_equal(reader.read_points(None, 5, 8, variables, np.s_[3:9]), p_sub[:,3:9]))
+	params_sub = params.copy()
+	params_sub['mean_type'] = 'longtime'
+	spod_sub = SPOD_low_storage(file_raw, params=params_sub, data_handler=reader, variables=['p'])
+	spod_sub.fit()
+	spod = SPOD_low_storage(p[:,10:40,::2], params=params_sub, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.allclose(spod_sub.eigs, spod.eigs, rtol=1e-10, atol=1e-12))
+	del reader, reader_npy
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_mask():
+	# Fit restricted to the valid points, given or inferred from NaNs
+	mask = np.ones(p.shape[1:], dtype=bool)
+	mask[10:20,5:30] = False
+	p_nan = p.copy()
+	p_nan[:,~mask] = np.nan
+	params_mask = params.copy()
+	params_mask['mean_type'] = 'longtime'
+	spod_full = SPOD_low_storage(np.where(mask, p, 0), params=params_mask, data_handler=False, variables=['p'])
+	spod_full.fit()
+	n_modes = spod_full._n_modes_save
+	for Engine in [SPOD_low_storage, SPOD_low_ram]:
+		params_mask['mask'] = 'auto'
+		spod = Engine(p_nan, params=params_mask, data_handler=False, variables=['p'])
+		spod.fit()
+		assert(spod.n_points == np.sum(mask))
+		assert(np.array_equal(spod.mask[...,0], mask))
+		assert(np.allclose(spod.eigs[:,:n_modes], spod_full.eigs[:,:n_modes], rtol=1e-10, atol=1e-12))
+		modes = spod.get_modes_at_freq(freq_idx=5)
+		modes_full = spod_full.get_modes_at_freq(freq_idx=5)
+		assert(modes.shape == modes_full.shape)
+		assert(np.allclose(np.abs(modes), np.abs(modes_full), atol=1e-10))
+		assert(np.all(modes[~mask] == 0))
+	params_mask['mask'] = mask
+	spod = SPOD_low_storage(p, params=params_mask, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.allclose(spod.eigs[:,:n_modes], spod_full.eigs[:,:n_modes], rtol=1e-10, atol=1e-12))
+
+	# NaNs appearing after the first snapshot are reported
+	p_nan[100:,30,10] = np.nan
+	params_mask['mask'] = 'auto'
+	for mean_type in ['longtime', 'blockwise']:
+		params_mask['mean_type'] = mean_type
+		try:
+			spod = SPOD_low_storage(p_nan, params=params_mask, data_handler=False, variables=['p'])
+			spod.fit()
+			assert(False)
+		except ValueError as e:
+			assert(str(30 * p.shape[2] + 10) in str(e))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_tiled():
+	# Domain processed in several tiles, compared to low_storage
+	params_tiled = params.copy()
+	params_tiled['overlap'] = 50
+	params_tiled['tile_memory_gb'] = 1e-3
+	for mean_type in ['longtime', 'blockwise']:
+		params_tiled['mean_type'] = mean_type
+		spod_ls = SPOD_low_storage(p, params=params_tiled, data_handler=False, variables=['p'])
+		spod_ls.fit()
+		for fuse_mean in [False, True]:
+			params_tiled['fuse_mean'] = fuse_mean
+			spod = SPOD_tiled(p, params=params_tiled, data_handler=False, variables=['p'])
+			# no pass over whole snapshots for the longtime mean
+			assert(spod.n_snapshots_read == 0)
+			spod.fit()
+			assert(spod._n_points_tile < spod.n_points)
+			assert(np.allclose(spod.eigs, spod_ls.eigs, rtol=1e-10, atol=1e-12))
+			for iFreq in [1, 5, 10]:
+				modes = spod.get_modes_at_freq(freq_idx=iFreq)
+				modes_ls = spod_ls.get_modes_at_freq(freq_idx=iFreq)
+				assert(np.allclose(np.abs(modes), np.abs(modes_ls), atol=1e-8))
+		params_tiled['fuse_mean'] = False
+
+	# tiles read alone from a memmap, or from whole snapshots
+	params_tiled['mean_type'] = 'longtime'
+	os.makedirs(os.path.join(CWD,'results'), exist_ok=True)
+	file_npy = os.path.join(CWD,'results','data.npy')
+	np.save(file_npy, p)
+	reader = MemmapReader(file_npy, subset=(slice(10, 40), slice(None, None, 2)))
+	def data_handler(data, t_0, t_end, variables):
+		return reader(data, t_0, t_end, variables)
+	spod_ref = SPOD_tiled(p[:,10:40,::2], params=params_tiled, data_handler=False, variables=['p'])
+	spod_ref.fit()
+	for handler in [reader, data_handler]:
+		spod = SPOD_tiled(file_npy, params=params_tiled, data_handler=handler, variables=['p'])
+		spod.fit()
+		assert(np.allclose(spod.eigs, spod_ref.eigs, rtol=1e-10, atol=1e-12))
+		modes = spod.get_modes_at_freq(freq_idx=5)
+		assert(np.allclose(modes, spod_ref.get_modes_at_freq(freq_idx=5), atol=1e-12))
+	del reader
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_streaming_batch():
+	# Streaming with snapshots read in batches (full-rank data)
+	rng = np.random.default_rng(0)
+	p_noise = p + 0.5 * rng.standard_normal(p.shape)
+	params_st = params.copy()
+	params_st['overlap'] = 30
+	params_st['mean_type'] = 'longtime'
+	eigs = []
+	for n_batch in [1, 7, 'auto']:
+		params_st['n_snapshots_batch'] = n_batch
+		spod = SPOD_streaming(p_noise, params=params_st, data_handler=False, variables=['p'])
+		spod.fit()
+		eigs.append(spod.eigs)
+	assert(np.allclose(eigs[1], eigs[0], rtol=1e-10, atol=1e-12))
+	assert(np.allclose(eigs[2], eigs[0], rtol=1e-10, atol=1e-12))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_streaming_partial_fit():
+	# Snapshots pushed in chunks, compared to fit (full-rank data)
+	rng = np.random.default_rng(0)
+	p_noise = p + 0.5 * rng.standard_normal(p.shape)
+	params_st = params.copy()
+	params_st['overlap'] = 30
+	params_st['mean_type'] = 'longtime'
+	spod = SPOD_streaming(p_noise, params=params_st, data_handler=False, variables=['p'])
+	spod.fit()
+	modes = spod.get_modes_at_freq(freq_idx=5)
+	spod_pf = SPOD_streaming(p_noise[0:1], params=params_st, data_handler=False, variables=['p'])
+	t_0 = 0
+	for n in [1, 37, 150, 12, 300]:
+		spod_pf.partial_fit(p_noise[t_0:t_0+n])
+		t_0 += n
+	assert(spod_pf.eigs.shape == spod.eigs.shape)
+	assert(spod_pf.get_current_modes_at_freq(5).shape == modes.shape)
+	spod_pf.partial_fit(p_noise[t_0:])
+	spod_pf.finalize()
+	assert(np.allclose(spod_pf.eigs, spod.eigs, rtol=1e-10, atol=1e-12))
+	assert(np.allclose(spod_pf.get_modes_at_freq(freq_idx=5), modes, atol=1e-10))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_streaming_state():
+	# Interrupted stream resumed from the saved state (full-rank data)
+	rng = np.random.default_rng(0)
+	p_noise = p + 0.5 * rng.standard_normal(p.shape)
+	params_st = params.copy()
+	params_st['overlap'] = 30
+	params_st['mean_type'] = 'blockwise'
+	params_st['n_snapshots_batch'] = 7
+	params_st['stream_checkpoint_blocks'] = 2
+	params_st['resume'] = True
+	t_max = [None]
+	def data_handler(data, t_0, t_end, variables):
+		if t_max[0] is not None and t_end > t_max[0]:
+			raise RuntimeError('interrupted')
+		if t_0 == t_end:
+			t_end = t_0 + 1
+		return data[t_0:t_end,...,np.newaxis]
+	spod_ref = SPOD_streaming(p_noise, params=params_st, data_handler=data_handler, variables=['p'])
+	spod_ref.fit()
+	modes_ref = spod_ref.get_modes_at_freq(freq_idx=5)
+	assert(not os.path.exists(spod_ref.state_path))
+
+	# interrupt the stream, then resume it
+	t_max[0] = 450
+	spod = SPOD_streaming(p_noise, params=params_st, data_handler=data_handler, variables=['p'])
+	try:
+		spod.fit()
+	except RuntimeError:
+		pass
+	assert(os.path.exists(spod.state_path))
+	t_max[0] = None
+	spod = SPOD_streaming(p_noise, params=params_st, data_handler=data_handler, variables=['p'])
+	spod.fit()
+	assert(np.array_equal(spod.eigs, spod_ref.eigs))
+	assert(np.array_equal(spod.get_modes_at_freq(freq_idx=5), modes_ref))
+
+	# interrupted after the last snapshot (the state holds all of them)
+	params_st['overlap'] = 50
+	params_st['n_snapshots'] = 908
+	params_st['stream_checkpoint_blocks'] = 1
+	spod_ref = SPOD_streaming(p_noise[:908], params=params_st, data_handler=False, variables=['p'])
+	spod_ref.fit()
+	def finalize():
+		raise RuntimeError('interrupted')
+	spod = SPOD_streaming(p_noise[:908], params=params_st, data_handler=False, variables=['p'])
+	spod.finalize = finalize
+	try:
+		spod.fit()
+	except RuntimeError:
+		pass
+	assert(os.path.exists(spod.state_path))
+	spod = SPOD_streaming(p_noise[:908], params=params_st, data_handler=False, variables=['p'])
+	spod.fit()
+	assert(np.array_equal(spod.eigs, spod_ref.eigs))
+
+	# clean up results
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
 
 if __name__ == "__main__":
 	test_basic_spod_low_storage()
 	test_basic_spod_low_ram()
 	test_basic_spod_low_ram_default()
+	test_basic_compute_blocks_batch()
+	test_basic_compute_blocks_integer()
+	test_basic_compute_blocks_parallel()
+	test_basic_compute_blocks_threaded_handler()
+	test_basic_snapshots_buffer()
+	test_basic_fused_mean()
+	test_basic_eig_solvers()
+	test_basic_eig_batched()
+	test_basic_freq_parallel()
+	test_basic_blocks_store()
+	test_basic_blocks_transpose()
+	test_basic_prefetch()
+	test_basic_async_writer()
+	test_basic_blocks_manifest()
+	test_basic_resume()
+	test_basic_zero_copy()
+	test_basic_snapshot_directory_reader()
+	test_basic_memmap_reader()
+	test_basic_mask()
+	test_basic_tiled()
+	test_basic_streaming_batch()
+	test_basic_streaming_partial_fit()
+	test_basic_streaming_state()
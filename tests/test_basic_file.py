@@ -16,6 +16,7 @@ sys.path.append(os.path.join(CFD,"../pyspod"))
 from pyspod.spod_low_storage import SPOD_low_storage
 from pyspod.spod_low_ram     import SPOD_low_ram
 from pyspod.spod_streaming   import SPOD_streaming
+from pyspod.utils_readers    import XarrayReader, MultiFileReader
 
 # Let's create some 2D syntetic data
 # and store them into a variable called p
@@ -105,6 +106,88 @@ def test_basic_file_spod_low_storage():
 
 
 
+def test_basic_file_xarray_reader():
+	# Built-in reader with time slices aligned to the chunks of the file
+	file_chunked = os.path.join(CWD,'data_chunked.nc')
+	ds.to_netcdf(file_chunked, encoding={'p': {'chunksizes': (64, 50, 100)}})
+	reader = XarrayReader(dtype='float64')
+	spod_ls = SPOD_low_storage(
+		data=file_chunked,
+		params=params,
+		data_handler=reader,
+		variables=variables)
+	assert(reader.chunk_size(variables) == 64)
+	assert(np.array_equal(reader(file_chunked, 0, 0, variables)[...,0], p[[0]]))
+	assert(np.array_equal(reader(file_chunked, 10, 250, variables)[...,0], p[10:250]))
+	# each chunk is read once by the block pass
+	n_bytes = reader.bytes_read
+	spod_ls.compute_all_blocks(Q_hat=np.empty(
+		[spod_ls.n_freq, spod_ls.nx, spod_ls._n_blocks], dtype='complex_'))
+	assert(reader.bytes_read - n_bytes == p.nbytes)
+	spod_ls.fit()
+
+	# chunks larger than `max_chunk_gb` are read as exact slices
+	reader_exact = XarrayReader(file_chunked, dtype='float64', max_chunk_gb=1e-3)
+	assert(reader_exact.chunk_size(variables) == 1)
+	assert(np.array_equal(reader_exact(None, 10, 10, variables)[...,0], p[[10]]))
+	assert(reader_exact.bytes_read == p[0].nbytes)
+	reader_exact.close()
+
+	# same results as the hand-written reader
+	spod_ref = SPOD_low_storage(
+		data=os.path.join(CWD,'data.nc'),
+		params=params,
+		data_handler=read_data_netCDF,
+		variables=variables)
+	spod_ref.fit()
+	assert(np.allclose(spod_ls.eigs, spod_ref.eigs, rtol=1e-10, atol=1e-12))
+	reader.close()
+	os.remove(file_chunked)
+
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
+def test_basic_file_multi_file_reader():
+	# Snapshots read from several files concatenated along time
+	path_files = os.path.join(CWD,'data_files')
+	os.makedirs(path_files, exist_ok=True)
+	for i, ti in enumerate(np.array_split(np.arange(t.shape[0]), 7)):
+		ds.isel(time=ti).to_netcdf(os.path.join(path_files,'data_{:02d}.nc'.format(i)))
+	reader = MultiFileReader(os.path.join(path_files,'data_*.nc'), max_open=2)
+	assert(len(reader.files) == 7)
+	assert(reader.n_snapshots == t.shape[0])
+	assert(np.array_equal(reader(None, 0, 0, variables)[...,0], p[[0]]))
+	assert(np.array_equal(reader(None, 100, 700, variables)[...,0], p[100:700]))
+	reader_thr = MultiFileReader(os.path.join(path_files,'data_*.nc'), max_open=2, n_workers=2)
+	assert(np.array_equal(reader_thr(None, 100, 700, variables)[...,0], p[100:700]))
+	reader_thr.close()
+	spod_mf = SPOD_low_storage(
+		data=path_files,
+		params=params,
+		data_handler=reader,
+		variables=variables)
+	spod_mf.fit()
+	spod_ref = SPOD_low_storage(
+		data=os.path.join(CWD,'data.nc'),
+		params=params,
+		data_handler=read_data_netCDF,
+		variables=variables)
+	spod_ref.fit()
+	assert(np.allclose(spod_mf.eigs, spod_ref.eigs, rtol=1e-10, atol=1e-12))
+	reader.close()
+
+	try:
+		shutil.rmtree(os.path.join(CWD,'results'))
+		shutil.rmtree(path_files)
+	except OSError as e:
+		print("Error: %s : %s" % (os.path.join(CWD,'results'), e.strerror))
+
+
+
 def test_basic_file_spod_low_ram():
 	# Let's try the low_ram algorithm
 	spod_ram = SPOD_low_ram(
@@ -140,4 +223,6 @@ def test_basic_file_spod_low_ram():
 
 if __name__ == "__main__":
 	test_basic_file_spod_low_storage()
+	test_basic_file_xarray_reader   ()
+	test_basic_file_multi_file_reader()
 	test_basic_file_spod_low_ram    ()
@@ -13,6 +13,7 @@ sys.path.append(os.path.join(CFD, "../../../"))
 from pyspod.spod_low_storage import SPOD_low_storage
 from pyspod.spod_low_ram     import SPOD_low_ram
 from pyspod.spod_streaming   import SPOD_streaming
+from pyspod.utils_readers    import XarrayReader
 
 
 
@@ -46,14 +47,8 @@ ds.to_netcdf("data.nc")
 # to the constructor of pyspod to read data sequentially (thereby
 # reducing RAM requirements)
 
-# Reader for netCDF
-def read_data_netCDF(data, t_0, t_end, variables):
-    if t_0 == t_end: ti = [t_0]
-    else           : ti = np.arange(t_0,t_end)
-    X = np.empty([len(ti), x2.shape[0], x1.shape[0], len(variables)])
-    for _,var in enumerate(variables):
-        X = np.array(ds[var].isel(time=ti))
-    return X
+# Reader for netCDF (opens the file passed as `data` at the first read)
+read_data_netCDF = XarrayReader()
 x_nc = read_data_netCDF('data.nc', t_0=0, t_end=t.shape[0], variables=variables)
 x_nc_ssn = read_data_netCDF('data.nc', t_0=0, t_end=0, variables=variables)
 print('x_nc.shape = ', x_nc.shape)
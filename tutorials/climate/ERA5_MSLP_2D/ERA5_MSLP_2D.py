@@ -16,6 +16,7 @@ from pyspod.spod_low_storage import SPOD_low_storage
 from pyspod.spod_low_ram     import SPOD_low_ram
 from pyspod.spod_streaming   import SPOD_streaming
 import pyspod.utils_weights as utils_weights
+import pyspod.utils_readers as utils_readers
 
 # Current path
 CWD = os.getcwd()
@@ -36,13 +37,9 @@ print('shape of x2 (latitude) : ', x2.shape)
 
 
 
-def read_data(data, t_0, t_end, variables):
-	if t_0 == t_end: ti = [t_0]
-	else           : ti = np.arange(t_0,t_end)
-	X = np.empty([len(ti), x2.shape[0], x1.shape[0], len(variables)])
-	for _,var in enumerate(variables):
-		X = np.array(ds[var].isel(time=ti))
-	return X
+# reader of the data, keeping the dataset open and reading
+# contiguous time slices aligned to the chunks of the file
+read_data = utils_readers.XarrayReader(ds)
 
 # we set the variables we want to use for the analysis
 # (we select all the variables present) and load the in RAM